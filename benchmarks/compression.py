@@ -0,0 +1,71 @@
+"""
+Compares compressing images in threads against the process pool pipeline
+
+Reports images per second, and how late the event loop runs a 10ms timer while compressing
+Run with `python -m benchmarks.compression [images] [size]`
+"""
+
+import asyncio
+import io
+import os
+import statistics
+import sys
+import time
+
+from PIL import Image
+
+from source import compression
+
+
+def make_image(size: int) -> bytes:
+    """A noisy png, so the encoder has some work to do"""
+    image = Image.frombytes("RGB", (size, size), os.urandom(size * size * 3))
+    # upscale the noise, to look a little more like a photo
+    image = image.resize((size * 2, size * 2), Image.BILINEAR)
+    output = io.BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+async def measure_lag(stop: asyncio.Event, lags: list, interval: float = 0.01):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def run(name: str, images: list, compress):
+    lags = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_lag(stop, lags))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[compress(data) for data in images])
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await ticker
+    print(
+        f"{name:<8} {len(images) / elapsed:8.1f} images/s   "
+        f"loop lag mean {statistics.mean(lags) * 1000:6.1f}ms  max {max(lags) * 1000:6.1f}ms"
+    )
+
+
+async def main(count: int, size: int):
+    print(f"Generating {count} images of {size * 2}x{size * 2}...")
+    images = [make_image(size) for _ in range(count)]
+
+    await run("thread", images, lambda data: asyncio.to_thread(compression.compress, data))
+
+    pipeline = compression.CompressionPipeline()
+    pipeline.start()
+    # the first images would otherwise pay for starting the worker processes
+    await pipeline.compress(images[0])
+    await run("process", images, pipeline.compress)
+    pipeline.shutdown()
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+    asyncio.run(main(count, size))
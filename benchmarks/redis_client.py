@@ -0,0 +1,95 @@
+"""
+Compares the pooled asyncio redis client against the old sync client run in threads
+
+Reports the round trip latency of sequential GETs, and ops per second with many concurrent callers
+Needs a redis server on localhost, the benchmark only touches keys starting with `benchmark||`
+Run with `python -m benchmarks.redis_client [ops] [concurrency]`
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+
+import redis
+
+from source.dataclass import AsyncRedis
+
+
+class ThreadedRedis:
+    """The client AsyncRedis replaced, every command hops to a thread and back"""
+
+    def __init__(self, host="localhost", port=6379, db=0):
+        self.__redis = redis.Redis(host=host, port=port, db=db)
+
+    async def set(self, key, value):
+        return await asyncio.to_thread(self.__redis.set, key, value)
+
+    async def get(self, key):
+        return await asyncio.to_thread(self.__redis.get, key)
+
+    async def delete(self, *keys):
+        return await asyncio.to_thread(self.__redis.delete, *keys)
+
+    async def close(self):
+        self.__redis.close()
+
+
+async def latency(client, ops: int) -> list:
+    """Time sequential GETs, one request in flight at a time"""
+    times = []
+    for i in range(ops):
+        start = time.perf_counter()
+        await client.get(f"benchmark||{i % 100}")
+        times.append(time.perf_counter() - start)
+    return times
+
+
+async def throughput(client, ops: int, concurrency: int) -> float:
+    """Ops per second of SET then GET, from `concurrency` callers at once"""
+
+    async def worker(n: int):
+        for i in range(ops // concurrency // 2):
+            key = f"benchmark||{n}|{i % 100}"
+            await client.set(key, i)
+            await client.get(key)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(n) for n in range(concurrency)])
+    return (ops // concurrency // 2 * 2 * concurrency) / (time.perf_counter() - start)
+
+
+async def run(name: str, client, ops: int, concurrency: int):
+    for i in range(100):
+        await client.set(f"benchmark||{i}", i)
+
+    times = await latency(client, ops)
+    times.sort()
+    ops_per_second = await throughput(client, ops, concurrency)
+    print(
+        f"{name:<8} latency mean {statistics.mean(times) * 1e6:7.1f}us  "
+        f"p50 {times[len(times) // 2] * 1e6:7.1f}us  p99 {times[int(len(times) * 0.99)] * 1e6:7.1f}us   "
+        f"{ops_per_second:9.0f} ops/s"
+    )
+
+    await client.delete(*[f"benchmark||{i}" for i in range(100)])
+    await client.delete(*[f"benchmark||{n}|{i}" for n in range(concurrency) for i in range(100)])
+
+
+async def main(ops: int, concurrency: int):
+    print(f"{ops} ops, {concurrency} concurrent callers")
+
+    threaded = ThreadedRedis()
+    await run("thread", threaded, ops, concurrency)
+    await threaded.close()
+
+    pooled = AsyncRedis()
+    await pooled.connect()
+    await run("pooled", pooled, ops, concurrency)
+    await pooled.close()
+
+
+if __name__ == "__main__":
+    ops = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    asyncio.run(main(ops, concurrency))
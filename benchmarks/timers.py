@@ -0,0 +1,73 @@
+"""
+Measures the timer scheduler with a large number of timers
+
+Schedules, reschedules and cancels timers, then times how long the scheduler takes to catch up on every
+timer once they are all overdue, as happens after the bot has been offline
+Run with `python -m benchmarks.timers [timers]`
+"""
+
+import asyncio
+import random
+import sys
+import time
+
+from source import timers
+
+
+def timed(name: str, count: int, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<12} {count:>8} timers  {elapsed * 1000:8.1f}ms  {elapsed / count * 1e6:6.2f}us each")
+
+
+async def main(count: int):
+    fired = 0
+    done = asyncio.Event()
+    remaining = count - count // 10
+
+    async def callback(key):
+        nonlocal fired
+        fired += 1
+        if fired == remaining:
+            done.set()
+
+    scheduler = timers.TimerScheduler(callback)
+    now = time.time()
+    # due a minute from now, so nothing fires until the clock is wound forward
+    dues = [now + 60 + random.random() * 60 for _ in range(count)]
+
+    def schedule():
+        for key, due in enumerate(dues):
+            scheduler.schedule(key, due)
+
+    def reschedule():
+        for key in range(0, count, 2):
+            scheduler.schedule(key, dues[key] + random.random() * 60)
+
+    def cancel():
+        for key in range(0, count, 10):
+            scheduler.cancel(key)
+
+    timed("schedule", count, schedule)
+    timed("reschedule", count // 2, reschedule)
+    timed("cancel", count // 10, cancel)
+
+    # wind the clock forward, so every timer is overdue, like after downtime
+    real_time = time.time
+    time.time = lambda: real_time() + 3600
+    try:
+        start = time.perf_counter()
+        scheduler.start()
+        await done.wait()
+        elapsed = time.perf_counter() - start
+    finally:
+        time.time = real_time
+        scheduler.shutdown()
+
+    print(f"{'catch up':<12} {fired:>8} timers  {elapsed * 1000:8.1f}ms  {fired / elapsed:9.0f} timers/s")
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    asyncio.run(main(count))
@@ -1,5 +1,6 @@
 import asyncio
 import logging
+import os
 import traceback
 from datetime import datetime
 
@@ -37,6 +38,10 @@ bot = dataclass.Bot(
     ],
     help_command=None,
     sync_commands=False,
+    durable_events=False,
+    consume_events=True,
+    # give each process on a host its own id when running several workers
+    worker_id=os.environ.get("PALADIN_WORKER_ID", "0"),
     activity=discord.Game("Startup"),
 )
 slash = bot.slash
@@ -64,6 +69,13 @@ async def startupTasks():
     bot.appInfo = await bot.application_info()
     bot.startTime = datetime.now()
 
+    bot.start_cache_invalidation()
+    # learn rate limits from every response discord.py gets
+    bot.outbound.attach(bot.http._HTTPClient__session)
+
+    log.info("Caching guild data")
+    await bot.cache_all_guild_data()
+
     log.info("Caching permission data")
     slash.perms_cache = {}
     for guild in bot.guilds:
@@ -82,6 +94,13 @@ async def startupTasks():
                 log.error("".join(traceback.format_exception(type(e), e, e.__traceback__)))
     bot.paladinEvents.process = True
     bot.paladinEvents.task = asyncio.create_task(bot.paladinEvents.event_loop())
+    if bot.paladinEvents.stream is not None:
+        bot.paladinEvents.stream.start(bot.paladinEvents)
+
+    try:
+        await bot.log_batcher.recover()
+    except Exception as e:
+        log.error("".join(traceback.format_exception(type(e), e, e.__traceback__)))
 
 
 @bot.event
@@ -1,14 +1,15 @@
 import asyncio
+import collections
+import functools
 import json
 import logging
 import traceback
-from datetime import datetime, timedelta
+import typing
+from datetime import datetime, timedelta, timezone
 
-from discord.ext import tasks
-from discord.utils import snowflake_time
 from discord_slash import cog_ext
 
-from source import utilities, dataclass, jsonManager
+from source import utilities, dataclass, jsonManager, outbound, snowflake, timers
 from source.shared import *
 
 log: logging.Logger = utilities.getLog("Cog::AutoDel")
@@ -31,52 +32,219 @@ class AutoDelete(commands.Cog):
 
         self.events = self.bot.paladinEvents
 
+        self.channels: typing.Dict[int, int] = {}
+        """The auto-delete channels in our guilds, and how many minutes their messages last"""
+
+        self.scheduler = timers.TimerScheduler(self._enqueue)
+        """Wakes each channel when its oldest message is due"""
+
+        self.workers = 4
+        """How many channels are deleted from at once"""
+
+        # guild id -> channels waiting for a worker, guilds take turns
+        self._queue: "collections.OrderedDict[int, collections.deque]" = collections.OrderedDict()
+        # channels that are queued or being worked on
+        self._pending: typing.Set[int] = set()
+        self._active = 0
+        self._wakeup = asyncio.Event()
+        self._worker_tasks: typing.List[asyncio.Task] = []
+
+        self._cycle: typing.Optional[dict] = None
+        self.last_cycle: typing.Optional[dict] = None
+        """Stats from the last time the queue was drained"""
+
     async def setup(self):
-        # await self.cache_guild_data()
-        self.task.start()
+        for guild in self.bot.guilds:
+            guild_data = await self.bot.get_guild_data(guild.id)
+            if guild_data and guild_data.auto_delete_data:
+                for channel_data in guild_data.auto_delete_data:
+                    self.channels[int(channel_data["channel_id"])] = int(channel_data["delete_after"])
+        log.debug(f"Tracking {len(self.channels)} auto-delete channels")
+
+        self.bot.add_listener(self.on_message, "on_message")
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self.scheduler.start()
+        for channel_id in self.channels:
+            # clear anything that came due while offline, and backfill new channels
+            self.scheduler.schedule(channel_id, datetime.utcnow())
+
+    def cog_unload(self):
+        self.scheduler.shutdown()
+        for task in self._worker_tasks:
+            task.cancel()
+
+    @staticmethod
+    def _key(channel_id) -> str:
+        """The key of a channel's tracked messages, a zset of message id by creation time"""
+        return f"autodel||{channel_id}"
+
+    async def on_message(self, message: discord.Message):
+        """Tracks messages sent in auto-delete channels"""
+        delete_after = self.channels.get(message.channel.id)
+        if delete_after is None:
+            return
+
+        timestamp = snowflake.to_timestamp(message.id)
+        await self.bot.redis.zadd(self._key(message.channel.id), {message.id: timestamp})
+        if message.channel.id not in self.scheduler:
+            # otherwise the channel is already due to wake for an older message
+            self.scheduler.schedule(message.channel.id, timestamp + delete_after * 60)
+
+    async def backfill(self, channel: discord.TextChannel):
+        """Tracks the messages sent in a channel before it was configured, only runs once per channel"""
+        if await self.bot.redis.sismember("autodel_backfilled", channel.id):
+            return
+
+        log.debug(f"Backfilling auto-delete channel {channel.id}")
+        batch = {}
+        after = discord.Object(id=snowflake.ago(timedelta(days=14).total_seconds()))
+        async for message in channel.history(limit=None, after=after):
+            batch[message.id] = snowflake.to_timestamp(message.id)
+            if len(batch) >= 1000:
+                await self.bot.redis.zadd(self._key(channel.id), batch)
+                batch = {}
+        if batch:
+            await self.bot.redis.zadd(self._key(channel.id), batch)
+        await self.bot.redis.sadd("autodel_backfilled", channel.id)
+
+    async def delete_due(
+        self, channel: discord.TextChannel, delete_after: int, limit: int = 100
+    ) -> typing.Tuple[int, float]:
+        """Deletes up to `limit` tracked messages older than `delete_after` minutes
+
+        :returns how many were deleted, and how late, in seconds, the oldest of them was
+        """
+        key = self._key(channel.id)
+        now = datetime.now(tz=timezone.utc).timestamp()
+
+        # bots cant bulk delete messages older than 14 days, so stop tracking them a little before then
+        await self.bot.redis.zremrangebyscore(key, "-inf", now - timedelta(days=14).total_seconds() + 60)
+
+        due = await self.bot.redis.zrangebyscore(
+            key, "-inf", now - delete_after * 60, start=0, num=limit, withscores=True
+        )
+        if not due:
+            return 0, 0
+        message_ids = [int(m) for m, _ in due]
+        lag = now - (due[0][1] + delete_after * 60)
+
+        # bulk delete can only take 100 messages at a time
+        for i in range(0, len(message_ids), 100):
+            chunk = message_ids[i : i + 100]
+            try:
+                await self.bot.outbound.send(
+                    "POST",
+                    f"/channels/{channel.id}/messages/bulk-delete",
+                    functools.partial(channel.delete_messages, [discord.Object(id=m) for m in chunk]),
+                    guild_id=channel.guild.id,
+                    priority=outbound.Priority.log,
+                )
+            except discord.NotFound:
+                # a lone message that was already deleted
+                pass
+            await self.bot.redis.zrem(key, *chunk)
+        return len(message_ids), lag
+
+    async def _next_due(self, channel_id: int, delete_after: int) -> typing.Optional[float]:
+        """When the oldest tracked message in a channel is due"""
+        oldest = await self.bot.redis.zrangebyscore(
+            self._key(channel_id), "-inf", "+inf", start=0, num=1, withscores=True
+        )
+        if not oldest:
+            return None
+        return oldest[0][1] + delete_after * 60
+
+    async def _enqueue(self, channel_id: int):
+        """Queue a channel for a worker, called by the scheduler when a channel has messages due"""
+        channel: discord.TextChannel = self.bot.get_channel(channel_id)
+        if channel is None or channel_id not in self.channels or channel_id in self._pending:
+            return
+        if self._cycle is None:
+            self._cycle = {"start": datetime.utcnow(), "deleted": 0, "lag": {}}
+
+        self._pending.add(channel_id)
+        self._queue.setdefault(channel.guild.id, collections.deque()).append(channel_id)
+        self._wakeup.set()
+
+    def _next_channel(self) -> typing.Optional[int]:
+        """The next channel to work on, each guild with channels waiting takes its turn"""
+        if not self._queue:
+            return None
+        guild_id, channels = self._queue.popitem(last=False)
+        channel_id = channels.popleft()
+        if channels:
+            # back of the line
+            self._queue[guild_id] = channels
+        return channel_id
+
+    async def _worker(self):
+        while True:
+            channel_id = self._next_channel()
+            if channel_id is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            self._active += 1
+            try:
+                backlog = await self._process(channel_id)
+            finally:
+                self._active -= 1
+                self._pending.discard(channel_id)
+
+            if backlog:
+                # there's more due, take another turn once the other guilds have had theirs
+                await self._enqueue(channel_id)
+            elif not self._queue and not self._active:
+                self._end_cycle()
+
+    async def _process(self, channel_id: int) -> bool:
+        """Deletes one batch of due messages from a channel, returns if there are more due"""
+        delete_after = self.channels.get(channel_id)
+        channel: discord.TextChannel = self.bot.get_channel(channel_id)
+        if delete_after is None or channel is None:
+            return False
 
-    @tasks.loop(minutes=1)
-    async def task(self):
         try:
-            log.spam("Running delete task...")
-
-            for guild in self.bot.guilds:
-                # get guild data and determine if this server is using auto delete
-                guild_data = await self.bot.get_guild_data(guild.id)
-                if guild_data:
-                    auto_del_data = guild_data.auto_delete_data
-                    if not auto_del_data:
-                        continue
-
-                    for channel_data in auto_del_data:
-                        channel: discord.TextChannel = self.bot.get_channel(int(channel_data["channel_id"]))
-                        if channel:
-                            messages_to_delete = {}
-                            async for message in channel.history(
-                                limit=None, after=datetime.utcnow() - timedelta(days=14)
-                            ):
-                                message_age = datetime.utcnow() - snowflake_time(message.id)
-                                # message is younger than 14 days, but older than specified time
-                                if message_age.total_seconds() >= int(channel_data["delete_after"]) * 60:
-                                    messages_to_delete[message.id] = message
-                                    if len(messages_to_delete) >= 200:
-                                        # to avoid api spamming, i only want to delete in batches of 200 at most
-                                        break
-                            if len(messages_to_delete) != 0:
-                                messages_to_delete = list(messages_to_delete.values())
-                                # bulk delete can only take 100 messages at a time,
-                                # so we chunk the deletions into batches of 100 or less
-                                message_chunk = []
-                                for i, msg in enumerate(messages_to_delete):
-                                    message_chunk.append(msg)
-                                    if len(message_chunk) == 100 or i == len(messages_to_delete) - 1:
-                                        await channel.delete_messages(message_chunk)
-                                        message_chunk = []
-                                log.spam(f"Deleted {len(messages_to_delete)} messages")
-
-                await asyncio.sleep(0)
+            await self.backfill(channel)
+            deleted, lag = await self.delete_due(channel, delete_after)
         except Exception as e:
             log.error("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+            # try again in a minute
+            if channel_id not in self.scheduler:
+                self.scheduler.schedule(channel_id, datetime.utcnow() + timedelta(minutes=1))
+            return False
+
+        if deleted:
+            self._cycle["deleted"] += deleted
+            self._cycle["lag"][channel_id] = max(self._cycle["lag"].get(channel_id, 0), lag)
+
+        next_due = await self._next_due(channel_id, delete_after)
+        if next_due is not None and next_due <= datetime.now(tz=timezone.utc).timestamp():
+            return True
+
+        # a new message may have scheduled the channel while we were deleting, keep whichever is sooner
+        scheduled = self.scheduler.get(channel_id)
+        if next_due is not None and (scheduled is None or next_due < scheduled):
+            self.scheduler.schedule(channel_id, next_due)
+        return False
+
+    def _end_cycle(self):
+        """Reports the throughput of the cycle that just finished"""
+        cycle, self._cycle = self._cycle, None
+        if cycle is None:
+            return
+        duration = max((datetime.utcnow() - cycle["start"]).total_seconds(), 0.001)
+        cycle["duration"] = duration
+        self.last_cycle = cycle
+
+        if cycle["deleted"]:
+            worst = sorted(cycle["lag"].items(), key=lambda item: item[1], reverse=True)[:5]
+            log.debug(
+                f"Auto-delete cycle: {cycle['deleted']} messages from {len(cycle['lag'])} channels in "
+                f"{duration:.1f}s ({cycle['deleted'] / duration:.1f}/s), "
+                f"worst lag: {', '.join(f'{c}={lag:.1f}s' for c, lag in worst)}"
+            )
 
     @cog_ext.cog_subcommand(**jsonManager.getDecorator("disable.autodelete"))
     async def disable_cmd(self, ctx: SlashContext, channel: discord.TextChannel = None):
@@ -101,7 +269,13 @@ class AutoDelete(commands.Cog):
         del auto_del_data[index]
 
         guild_data.auto_delete_data = auto_del_data
-        await self.bot.redis.set(guild_data.key, guild_data.to_json())
+        await self.bot.set_guild_data(guild_data)
+
+        # stop tracking the channel, if it is set up again it will be backfilled
+        self.channels.pop(channel.id, None)
+        self.scheduler.cancel(channel.id)
+        await self.bot.redis.delete(self._key(channel.id))
+        await self.bot.redis.srem("autodel_backfilled", channel.id)
 
         await ctx.send(f"Got it, auto-deletion has been disabled in {channel.mention}", hidden=True)
 
@@ -150,11 +324,14 @@ class AutoDelete(commands.Cog):
 
         try:
             guild_data.auto_delete_data = auto_del_data
-            await self.bot.redis.set(guild_data.key, guild_data.to_json())
+            await self.bot.set_guild_data(guild_data)
+
+            self.channels[channel.id] = time
+            self.scheduler.schedule(channel.id, datetime.utcnow())
 
             await ctx.send(
                 f"New Messages sent in `{channel.name}` will now be deleted after `{time}` minute{'s' if time > 1 else ''}\n"
-                f"**Note:** This channel will be checked for messages that match that rule within the a minute",
+                f"**Note:** Messages already in this channel that match that rule will be deleted shortly",
                 hidden=True,
             )
         except Exception as e:
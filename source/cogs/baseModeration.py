@@ -1,13 +1,23 @@
+import asyncio
+import functools
 import logging
-from datetime import datetime, timedelta
+import re
+import time
 
+import regex
+from discord.ext import tasks
 from discord_slash import cog_ext
 
-from source import utilities, dataclass, jsonManager
+from source import utilities, dataclass, jsonManager, outbound, purgeEngine, snowflake
 from source.shared import *
 
 log: logging.Logger = utilities.getLog("Cog::BaseMod")
 
+purge_max_channels = 10
+
+purge_edit_window = 14 * 60
+"""How long, in seconds, a purge's response can be edited, interaction tokens expire after 15 minutes"""
+
 
 class BaseModeration(commands.Cog):
     """Configuration commands"""
@@ -19,6 +29,81 @@ class BaseModeration(commands.Cog):
 
         self.emoji = bot.emoji_list
 
+        # purges still deleting older messages in the background
+        self._purges: typing.Set[asyncio.Task] = set()
+
+    async def setup(self):
+        self.bot.add_listener(self.on_message, "on_message")
+        self.bot.add_listener(self.on_raw_message_delete, "on_raw_message_delete")
+        self.bot.add_listener(self.on_raw_bulk_message_delete, "on_raw_bulk_message_delete")
+        self.bot.add_listener(self.on_ready, "on_ready")
+        # the index only knows about messages from here on
+        self.bot.recent_messages.reset()
+        self.expire_task.start()
+
+    def cog_unload(self):
+        self.expire_task.cancel()
+        for task in self._purges:
+            task.cancel()
+
+    # region: message index
+
+    async def on_message(self, message: discord.Message):
+        if message.guild is not None:
+            self.bot.recent_messages.add(message.channel.id, message.id)
+
+    async def on_ready(self):
+        # a new gateway session, anything sent while we were disconnected was missed
+        self.bot.recent_messages.reset()
+
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        self.bot.recent_messages.discard(payload.channel_id, payload.message_id)
+
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        self.bot.recent_messages.discard(payload.channel_id, *payload.message_ids)
+
+    @tasks.loop(hours=1)
+    async def expire_task(self):
+        self.bot.recent_messages.expire()
+
+    # endregion: message index
+
+    @staticmethod
+    def _purge_embed(ctx: SlashContext, engine: purgeEngine.PurgeEngine) -> discord.Embed:
+        progress = engine.progress
+        emb = discord.Embed(
+            title="⚠ **Purging Channel** ⚠" if len(engine.channels) == 1 else "⚠ **Purging Channels** ⚠",
+            description=f"Requested by {ctx.author.mention}",
+            colour=discord.Colour.red(),
+        )
+        if progress.done:
+            emb.title = "Channel Purge Complete" if progress.total else "Channel Purge Failed"
+            if not progress.total and not engine.old:
+                emb.description = "**Note:** Discord only allows bots to purge messages that are less than 2 weeks old"
+        if progress.error is not None:
+            emb.description = f"**Stopped early:** {progress.error}"
+
+        emb.add_field(name="Deleted", value=f"{progress.total} messages", inline=False)
+        if progress.scanned:
+            emb.add_field(name="Scanned", value=f"{progress.scanned} messages", inline=False)
+        if progress.old_queued:
+            value = f"{progress.old_deleted} of {progress.old_queued} deleted"
+            if not progress.old_done:
+                value += ", these are deleted one at a time in the background"
+            emb.add_field(name="Older than 2 weeks", value=value, inline=False)
+        if progress.failed:
+            emb.add_field(name="Failed", value=f"{progress.failed} messages", inline=False)
+        if len(engine.channels) > 1:
+            emb.add_field(
+                name="Channels",
+                value="\n".join(f"{c.mention}: {progress.deleted[c.id]}" for c in engine.channels),
+                inline=False,
+            )
+        filters = engine.check.describe()
+        if filters:
+            emb.add_field(name="Filter", value="\n".join(filters), inline=False)
+        return emb
+
     @cog_ext.cog_subcommand(**jsonManager.getDecorator("purge.messages"))
     async def purge(
         self,
@@ -27,68 +112,102 @@ class BaseModeration(commands.Cog):
         user: discord.User = None,
         channel: discord.TextChannel = None,
         reason: str = None,
+        users: str = None,
+        channels: str = None,
+        pattern: str = None,
+        contains: int = None,
+        minutes: int = None,
+        old: bool = False,
     ):
-        if not isinstance(channel, discord.TextChannel):
+        if total < 1:
+            return await ctx.send("Sorry you need to purge at least 1 message", hidden=True)
+
+        targets = [channel or ctx.channel]
+        if channels:
+            for channel_id in re.findall(r"\d{15,20}", channels):
+                target = ctx.guild.get_channel(int(channel_id))
+                if target is None:
+                    return await ctx.send(f"Sorry I couldn't find the channel {channel_id}", hidden=True)
+                if target not in targets:
+                    targets.append(target)
+
+        if not all(isinstance(c, discord.TextChannel) for c in targets):
             return await ctx.send("Sorry you can only purge a text channel")
-
-        totalDeleted = set()
-
-        def check(m):
-            if len(totalDeleted) >= total:
-                return False
-            if m.id == msg.id:
-                return False
-            if user is None or m.author == user:
-                totalDeleted.add(m.id)
-                return True
-            return False
-
-        if not channel:
-            channel = ctx.channel
-
-        emb = discord.Embed(
-            title="⚠ **Purging Channel** ⚠",
-            description=f"Requested by {ctx.author.mention}",
-            colour=discord.Colour.red(),
+        if len(targets) > purge_max_channels:
+            return await ctx.send(f"Sorry you can only purge {purge_max_channels} channels at once", hidden=True)
+        for target in targets:
+            if not target.permissions_for(ctx.author).manage_messages:
+                return await ctx.send(f"Sorry you need `manage_messages` in {target.mention}", hidden=True)
+
+        authors = {int(a) for a in re.findall(r"\d{15,20}", users or "")}
+        if user is not None:
+            authors.add(user.id)
+
+        compiled = None
+        if pattern:
+            if len(pattern) > 200:
+                return await ctx.send("Sorry that pattern is too long", hidden=True)
+            try:
+                # the regex module can time out a match, see PurgeFilter
+                compiled = regex.compile(pattern, regex.IGNORECASE)
+            except regex.error as e:
+                return await ctx.send(f"Sorry that pattern isn't valid: {e}", hidden=True)
+
+        msg = await ctx.send(
+            embed=discord.Embed(
+                title="⚠ **Purging Channel** ⚠",
+                description=f"Requested by {ctx.author.mention}",
+                colour=discord.Colour.red(),
+            )
         )
-        if channel == ctx.channel:
-            msg = await ctx.send(embed=emb)
-        else:
-            await ctx.send(f"Purging {channel.mention}")
-            msg = await channel.send(embed=emb)
 
-        output = await channel.purge(
-            limit=1000,
-            after=datetime.utcnow() - timedelta(days=14),
-            check=check,
+        check = purgeEngine.PurgeFilter(
+            authors=authors,
+            pattern=compiled,
+            content=purgeEngine.Content(contains) if contains else None,
+            after=snowflake.ago(minutes * 60) if minutes else 0,
+            before=msg.id,
         )
-        if len(totalDeleted) == 0:
-            emb.title = "Channel Purge Failed"
-            emb.description = "**Note:** Discord only allows bots to purge messages that are less than 2 weeks old"
-        else:
-            emb.title = "Channel Purge Complete"
-            emb.add_field(name="Deleted", value=f"{len(output)} messages", inline=False)
-            if user is not None:
-                emb.add_field(
-                    name="Filter",
-                    value=f"Messages from {user.name} #{user.discriminator}",
-                    inline=False,
-                )
 
-        try:
-            await msg.edit(embed=emb)
-        except:
-            await ctx.send(embed=emb)
+        started = time.monotonic()
+
+        async def report(progress: purgeEngine.PurgeProgress):
+            embed = self._purge_embed(ctx, engine)
+            if time.monotonic() - started < purge_edit_window:
+                await self.bot.outbound.send(
+                    "PATCH",
+                    f"/channels/{msg.channel.id}/messages/{msg.id}",
+                    functools.partial(msg.edit, embed=embed),
+                    guild_id=ctx.guild.id,
+                    priority=outbound.Priority.interactive,
+                )
+            elif progress.old_done:
+                # the response can't be edited anymore, post the result instead
+                await self.bot.outbound.send(
+                    "POST",
+                    f"/channels/{ctx.channel.id}/messages",
+                    functools.partial(ctx.channel.send, embed=embed),
+                    guild_id=ctx.guild.id,
+                    priority=outbound.Priority.moderation,
+                )
 
-        await self.bot.paladinEvents.add_item(
-            Action(
-                actionType=ModActions.purge,
-                moderator=ctx.author,
-                guild=ctx.guild,
-                extra=channel,
-                reason=reason,
+        engine = purgeEngine.PurgeEngine(self.bot, targets, check, total, old=old, on_progress=report)
+        await engine.run()
+        if not engine.progress.old_done:
+            task = asyncio.create_task(engine.finish_old())
+            self._purges.add(task)
+            task.add_done_callback(self._purges.discard)
+
+        for target in targets:
+            await self.bot.paladinEvents.add_item(
+                Action(
+                    actionType=ModActions.purge,
+                    moderator=ctx.author,
+                    guild=ctx.guild,
+                    extra=target,
+                    reason=reason,
+                )
             )
-        )
 
     @cog_ext.cog_subcommand(**jsonManager.getDecorator("add.user"))
     async def giveRole(
@@ -132,7 +132,7 @@ class Config(commands.Cog):
                 )
 
             guild_data.moderation_roles.append(role.id)
-            await self.bot.redis.set(guild_data.key, guild_data.to_json())
+            await self.bot.set_guild_data(guild_data)
             await self.bot.add_permissions_to_commands()
             await self.sync_all_commands(ctx.guild_id)
 
@@ -161,7 +161,7 @@ class Config(commands.Cog):
                     "Commands are already disabled for that role, if they aren't in Discord, try restarting Discord"
                 )
             guild_data.moderation_roles.remove(role.id)
-            await self.bot.redis.set(guild_data.key, guild_data.to_json())
+            await self.bot.set_guild_data(guild_data)
             await self.bot.add_permissions_to_commands()
             await self.sync_all_commands(ctx.guild_id)
 
@@ -53,7 +53,7 @@ class LinkDetection(commands.Cog):
                 return
             output_channel: discord.TextChannel = self.bot.get_channel(int(guild_data.channel_mod_log_id))
             if output_channel:
-                await shared.send_with_webhook("Moderation Log", output_channel, emb)
+                await shared.send_with_webhook("Moderation Log", output_channel, emb, cache=self.bot.webhooks)
 
     async def handle_guild_invite(self, message, url):
         """Handle guild invites"""
@@ -146,7 +146,7 @@ class LinkDetection(commands.Cog):
 
         guild_data.block_bot_invites = toggle
 
-        await self.bot.redis.set(guild_data.key, guild_data.to_json())
+        await self.bot.set_guild_data(guild_data)
         await ctx.send(f"Bot invites are now {'blocked' if toggle else 'allowed'}")
 
     @cog_ext.cog_subcommand(
@@ -166,7 +166,7 @@ class LinkDetection(commands.Cog):
 
         guild_data.block_guild_invites = toggle
 
-        await self.bot.redis.set(guild_data.key, guild_data.to_json())
+        await self.bot.set_guild_data(guild_data)
         await ctx.send(f"Guild invites are now {'blocked' if toggle else 'allowed'}")
 
     @cog_ext.cog_subcommand(
@@ -186,7 +186,7 @@ class LinkDetection(commands.Cog):
 
         guild_data.log_urls = toggle
 
-        await self.bot.redis.set(guild_data.key, guild_data.to_json())
+        await self.bot.set_guild_data(guild_data)
         await ctx.send(f"URLs are now being {'logged' if toggle else 'ignored'}")
 
     @cog_ext.cog_subcommand(
@@ -220,7 +220,7 @@ class LinkDetection(commands.Cog):
                 return await ctx.send(f"Invites for `{guild}` are already allowed")
 
             guild_data.allowed_guild_invites.append(guild)
-            await self.bot.redis.set(guild_data.key, guild_data.to_json())
+            await self.bot.set_guild_data(guild_data)
 
             return await ctx.send(f"Invites for `{guild}` are now allowed")
 
@@ -229,7 +229,7 @@ class LinkDetection(commands.Cog):
                 return await ctx.send(f"Invites for `{guild}` aren't allowed")
 
             guild_data.allowed_guild_invites.remove(guild)
-            await self.bot.redis.set(guild_data.key, guild_data.to_json())
+            await self.bot.set_guild_data(guild_data)
 
             return await ctx.send(f"Invites for `{guild}` are no longer allowed")
 
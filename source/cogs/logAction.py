@@ -1,14 +1,25 @@
 import base64
+import functools
 import json
 import logging
 
 from discord_slash import cog_ext
 
-from source import utilities, jsonManager, dataclass
+from source import utilities, jsonManager, dataclass, outbound
 from source.shared import *
 
 log: logging.Logger = utilities.getLog("Cog::ActLog")
 
+# raise a counter to at least a value, ids already handed out by a running process are never reused
+seed_counter_script = """
+local current = tonumber(redis.call("GET", KEYS[1]) or "0")
+if tonumber(ARGV[1]) > current then
+    redis.call("SET", KEYS[1], ARGV[1])
+    return tonumber(ARGV[1])
+end
+return current
+"""
+
 
 class LogAction(commands.Cog):
     """Configuration commands"""
@@ -20,44 +31,64 @@ class LogAction(commands.Cog):
 
         self.bot.paladinEvents.subscribe_to_event(self.log_mod_action, "modAction")
 
-    async def _get_new_action_id(self, guild: discord.Guild) -> int:
+    async def setup(self):
+        await self.migrate_action_ids()
+
+    async def migrate_action_ids(self):
+        """Seeds the per-guild action id counters from existing action records, only needs to run once"""
+        if await self.bot.redis.get("migration||action_ids"):
+            return
+
+        log.info("Seeding action id counters...")
+        latest_ids = {}
+        async for raw_data in self.bot.redis.iter_scan("action||*"):
+            # the guild id is read from the record, as key prefixes are ambiguous (guild 1234 vs 12345)
+            guild_id = raw_data.get("guild_id")
+            latest_ids[guild_id] = max(latest_ids.get(guild_id, 0), int(raw_data.get("action_id")))
+
+        for guild_id, action_id in latest_ids.items():
+            await self.bot.redis.eval(seed_counter_script, 1, f"action_id||{guild_id}", action_id)
+
+        await self.bot.redis.set("migration||action_ids", 1)
+        log.info(f"Seeded action id counters for {len(latest_ids)} guilds")
+
+    async def _get_new_action_id(self, guild_id: int) -> int:
         """Gets an action ID for a new action"""
-        keys = await self.bot.redis.keys(f"action||{guild.id}*")
-        return len(keys) + 1
+        return await self.bot.redis.incr(f"action_id||{guild_id}")
 
     async def _writeActionToDb(
         self,
-        guild: discord.Guild,
+        guild_id: int,
         modAction: ModActions,
-        moderator: discord.Member,
+        moderator_id: int,
         reason: str,
         message: discord.Message,
         actionID: typing.Optional[int] = None,
-        user: typing.Optional[discord.Member] = None,
-        role: typing.Optional[discord.Role] = None,
+        user_id: typing.Optional[int] = None,
+        role_id: typing.Optional[int] = None,
     ):
         """Writes an action to the database"""
         try:
             if actionID is None:
-                actionID = await self._get_new_action_id(guild)
+                actionID = await self._get_new_action_id(guild_id)
 
             reason = json.dumps(reason)
             reason = base64.b64encode(reason.encode()).decode("utf-8")
 
-            obj = dataclass.ModAction(guild.id, actionID, modAction, moderator.id)
+            obj = dataclass.ModAction(guild_id, actionID, modAction, moderator_id)
             obj.reason = reason
             obj.message_id = message.id
             obj.channel_id = message.channel.id
-            obj.user_id = user.id if user else None
-            obj.role_id = role.id if role else None
+            obj.user_id = user_id
+            obj.role_id = role_id
 
             await self.bot.redis.set(obj.key, obj.to_json())
         except Exception as e:
             log.error(e)
 
-    async def log_mod_action(self, action: Action):
+    async def log_mod_action(self, action: ActionRecord):
         """Logs a moderation action"""
-        guild_data = await self.bot.get_guild_data(guild_id=action.guild.id)
+        guild_data = await self.bot.get_guild_data(guild_id=action.guild_id)
 
         if guild_data:
             if guild_data.channel_action_log_id is None:
@@ -70,7 +101,7 @@ class LogAction(commands.Cog):
 
         emb = discord.Embed(colour=new_blurple)
 
-        token = await self._get_new_action_id(action.guild)
+        token = await self._get_new_action_id(action.guild_id)
 
         # todo: replace this ugliness with a match statement when 3.10 is fully released
         if action.action_type == ModActions.kick or action.action_type == ModActions.ban:
@@ -99,7 +130,7 @@ class LogAction(commands.Cog):
         # Add generic data to embed
         emb.add_field(
             name="Moderator",
-            value=f"{action.moderator.name} #{action.moderator.discriminator} ({action.moderator.mention})",
+            value=self.fmt_user(action.moderator_name, action.moderator_discriminator, action.moderator_mention),
             inline=False,
         )
         reason = action.reason if action.reason is not None else f"**Moderator:** Please use `/reason {token}`"
@@ -109,69 +140,79 @@ class LogAction(commands.Cog):
             inline=False,
         )
 
-        msg = await channel.send(embed=emb, allowed_mentions=discord.AllowedMentions.none())
+        msg = await self.bot.outbound.send(
+            "POST",
+            f"/channels/{channel.id}/messages",
+            functools.partial(channel.send, embed=emb, allowed_mentions=discord.AllowedMentions.none()),
+            guild_id=action.guild_id,
+            priority=outbound.Priority.moderation,
+        )
         await self._writeActionToDb(
-            guild=action.guild,
+            guild_id=action.guild_id,
             actionID=token,
             modAction=action.action_type,
-            moderator=action.moderator,
+            moderator_id=action.moderator_id,
             reason=reason,
             message=msg,
-            user=action.user,
-            role=action.extra if isinstance(action.extra, discord.Role) else None,
+            user_id=action.user_id,
+            role_id=action.extra_id if action.extra_kind == ExtraKind.role else None,
         )
 
     # region: formatters
 
+    @staticmethod
+    def fmt_user(name, discriminator, mention):
+        return f"{name} #{discriminator} ({mention})"
+
     def fmt_kick(self, action, emb):
         emb.title = (
             f"{self.emoji['banned']} User Banned"
-            if action == ModActions.ban
+            if action.action_type == ModActions.ban
             else f"{self.emoji['MemberRemove']} User Kicked"
         )
         emb.add_field(
             name="User",
-            value=f"{action.user.name} #{action.user.discriminator} ({action.user.mention})",
+            value=self.fmt_user(action.user_name, action.user_discriminator, action.user_mention),
             inline=False,
         )
         return emb
 
     def fmt_role(self, action, emb):
-        emb.title = f"{self.emoji['members']} Role {'Given' if action == ModActions.roleGive else 'Removed'}"
+        given = action.action_type == ModActions.roleGive
+        emb.title = f"{self.emoji['members']} Role {'Given' if given else 'Removed'}"
         emb.add_field(
             name="User",
-            value=f"{action.user.name} #{action.user.discriminator} ({action.user.mention})",
+            value=self.fmt_user(action.user_name, action.user_discriminator, action.user_mention),
             inline=False,
         )
-        emb.add_field(name="Role", value=action.extra.name, inline=False)
+        emb.add_field(name="Role", value=action.extra_value, inline=False)
         return emb
 
     def fmt_warn(self, action, emb):
-        if "Cleared" in str(action.extra):
+        if "Cleared" in str(action.extra_value):
             emb.title = f"{self.emoji['rules']} User Warnings Cleared"
         else:
             emb.title = f"{self.emoji['rules']} User Warned"
 
-        warnings = action.extra
+        warnings = action.extra_value
         emb.add_field(
             name="User",
-            value=f"{action.user.name} #{action.user.discriminator} ({action.user.mention})",
+            value=self.fmt_user(action.user_name, action.user_discriminator, action.user_mention),
             inline=False,
         )
         emb.add_field(name="Warnings", value=warnings, inline=False)
         return emb
 
     def fmt_purge(self, action, emb):
-        actChannel: discord.TextChannel = action.extra
         emb.title = f"{self.emoji['deleted']} Channel Purged"
-        emb.add_field(name="Channel", value=actChannel.mention, inline=False)
+        emb.add_field(name="Channel", value=action.extra_mention, inline=False)
         return emb
 
     def fmt_mute(self, action, emb):
         emb.title = f"{self.emoji['voiceLocked']} User Muted"
         emb.add_field(
             name="User",
-            value=f"{action.user.name} #{action.user.discriminator} ({action.user.mention})",
+            value=self.fmt_user(action.user_name, action.user_discriminator, action.user_mention),
             inline=False,
         )
         return emb
@@ -180,7 +221,7 @@ class LogAction(commands.Cog):
         emb.title = f"{self.emoji['voice']} User Un-Muted"
         emb.add_field(
             name="User",
-            value=f"{action.user.name} #{action.user.discriminator} ({action.user.mention})",
+            value=self.fmt_user(action.user_name, action.user_discriminator, action.user_mention),
             inline=False,
         )
         return emb
@@ -216,7 +257,13 @@ class LogAction(commands.Cog):
                     original_embed.remove_field(i)
             original_embed.add_field(name="Action ID", value=str(id), inline=False)
             original_embed.add_field(name="Reason", value=reason, inline=False)
-            await message.edit(embed=original_embed)
+            await self.bot.outbound.send(
+                "PATCH",
+                f"/channels/{chnl.id}/messages/{message.id}",
+                functools.partial(message.edit, embed=original_embed),
+                guild_id=ctx.guild_id,
+                priority=outbound.Priority.interactive,
+            )
         await ctx.send(f"Your reason has been stored for action #{id}")
 
     @cog_ext.cog_subcommand(
@@ -239,7 +286,7 @@ class LogAction(commands.Cog):
         guild_data = await self.bot.get_guild_data(ctx.guild_id)
         guild_data.channel_action_log_id = channel.id
 
-        await self.bot.redis.set(guild_data.key, guild_data.to_json())
+        await self.bot.set_guild_data(guild_data)
 
         await ctx.send(f"Set action log channel to {channel.mention}", hidden=True)
 
@@ -254,7 +301,7 @@ class LogAction(commands.Cog):
         guild_data = await self.bot.get_guild_data(ctx.guild_id)
         guild_data.channel_action_log_id = None
 
-        await self.bot.redis.set(guild_data.key, guild_data.to_json())
+        await self.bot.set_guild_data(guild_data)
 
         await ctx.send(f"Disabled action logging")
 
@@ -1,13 +1,13 @@
 import asyncio
 import logging
-import os
+import traceback
 from datetime import datetime
 
 import discord
+from discord.ext import tasks
 from discord_slash import cog_ext
-from PIL import Image
 
-from source import dataclass, shared, utilities
+from source import compression, dataclass, downloads, imageStore, shared, utilities
 from source.shared import *
 
 log: logging.Logger = utilities.getLog("Cog::Log")
@@ -23,8 +23,20 @@ class ModLog(commands.Cog):
 
         self.emoji = bot.emoji_list
 
+        self.images = imageStore.ImageStore(bot.redis)
+        """Where attachment images are kept, for logging deleted messages"""
+
+        self.compressor = compression.CompressionPipeline(image_format="webp", quality=60)
+        """Compresses images before they are stored"""
+
+        self.downloads = downloads.DownloadPool(self.store_image, workers=4)
+        """Downloads images off the gateway listener"""
+
     async def setup(self):
         """The startup tasks for this cog"""
+        self.compressor.start()
+        self.downloads.start()
+
         self.bot.add_listener(self.on_message, "on_message")
         self.bot.add_listener(self.on_member_join, "on_member_join")
         self.bot.add_listener(self.on_member_remove, "on_member_remove")
@@ -35,6 +47,25 @@ class ModLog(commands.Cog):
         self.bot.add_listener(self.on_member_unban, "on_member_unban")
         self.bot.add_listener(self.on_purge, "on_raw_bulk_message_delete")
 
+        self.sweep_task.start()
+
+    def cog_unload(self):
+        self.sweep_task.cancel()
+        asyncio.create_task(self.downloads.close())
+        self.compressor.shutdown()
+
+    async def close(self):
+        """Close the download session before the bot shuts down"""
+        await self.downloads.close()
+
+    @tasks.loop(minutes=1)
+    async def sweep_task(self):
+        """Expires and evicts stored images a batch at a time"""
+        try:
+            await self.images.sweep()
+        except Exception as e:
+            log.error("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+
     async def event_handler(self, event, **kwargs):
         """Handles all discord py events"""
 
@@ -75,9 +106,13 @@ class ModLog(commands.Cog):
             return log.error(f"Uncaught event: {event}")
 
         if not emb == discord.Embed(colour=new_blurple):
-            await shared.send_with_webhook("Moderation Log", output_channel, emb, file)
             if file:
+                # files can't be queued, send what is already queued first so the log stays in order
+                await self.bot.log_batcher.flush(output_channel.id)
+                await shared.send_with_webhook("Moderation Log", output_channel, emb, file, cache=self.bot.webhooks)
                 file.fp.close()
+            else:
+                await self.bot.log_batcher.add(output_channel, emb)
 
     # region: formatters
     async def fmt_msg_delete(self, emb: discord.Embed, kwargs: dict):
@@ -99,12 +134,12 @@ class ModLog(commands.Cog):
             emb.add_field(name="Content", value=before.clean_content, inline=False)
 
         if before.attachments:
-            for attachment in before.attachments:
-                if str(attachment.content_type).startswith("image/"):
-                    extension = str(attachment.filename).split(".")[-1]
-                    if os.path.exists(f"data/images/{before.guild.id}_{before.id}_{attachment.id}.{extension}"):
-                        f = open(f"data/images/{before.guild.id}_{before.id}_{attachment.id}.{extension}", "rb")
-                        file = discord.File(f)
+            for image in await self.images.get(before.id):
+                try:
+                    f = open(image.path, "rb")
+                except FileNotFoundError:
+                    continue
+                file = discord.File(f, filename=f"{image.attachment_id}.{image.extension}")
         emb.add_field(name="Channel", value=kwargs["before"].channel.mention, inline=False)
         return file
 
@@ -265,57 +300,34 @@ class ModLog(commands.Cog):
 
     # endregion: formatters
 
-    @staticmethod
-    def compress_image(filename: str):
-        """Compresses an image, intended to be used inside a thread"""
-        image = Image.open(filename)
-        max_size = 1920
-        if image.size[0] > max_size:
-            # we dont want to save huge images, so downscale all images to be smaller than X-1920
-            resize_factor = image.size[0] / max_size
-            image = image.resize(
-                (int(image.size[0] / resize_factor), int(image.size[1] / resize_factor)), Image.ANTIALIAS
-            )
-        elif image.size[1] > max_size:
-            # catch images that are rotated and huge
-            resize_factor = image.size[1] / max_size
-            image = image.resize(
-                (int(image.size[0] / resize_factor), int(image.size[1] / resize_factor)), Image.ANTIALIAS
-            )
-
-        # we dont want to ever be without a saved image, so create a temporary file and replace the original after compression
-        tempName = filename.replace("data/images/", "data/images/TEMP")
-        image.save(tempName, optimize=True, quality=60)
-        image.close()
-        os.replace(tempName, filename)
-
     # region: events
     async def on_message(self, message: discord.Message):
-        """Handles storage of images for display when their message is deleted"""
-        if message.attachments is not None:
-            for attachment in message.attachments:
-                attachment: discord.Attachment
-                if str(attachment.content_type).startswith("image/"):
-                    # attachment is an image
-
-                    guild_data = await self.bot.get_guild_data(message.guild.id)
-                    if guild_data.store_images:
-                        if not os.path.exists("data/images"):
-                            os.makedirs("data/images", exist_ok=True)
-                        extension = str(attachment.filename).split(".")[-1]
-
-                        f = open(f"data/images/{message.guild.id}_{message.id}_{attachment.id}.{extension}", "wb")
-                        try:
-                            await attachment.save(f)
-                        except discord.HTTPException or discord.NotFound:
-                            return
-                        f.close()
-
-                        if extension not in ["gif"]:
-                            await asyncio.to_thread(
-                                self.compress_image,
-                                f"data/images/{message.guild.id}_{message.id}_{attachment.id}.{extension}",
-                            )
+        """Queues images to be stored for display when their message is deleted"""
+        if not message.attachments or message.guild is None:
+            return
+        images = [a for a in message.attachments if str(a.content_type).startswith("image/")]
+        if not images:
+            return
+
+        guild_data = await self.bot.get_guild_data(message.guild.id)
+        if guild_data and guild_data.store_images:
+            for attachment in images:
+                self.downloads.submit(message.guild.id, message.id, attachment)
+
+    async def store_image(self, job: downloads.DownloadJob, data: bytes):
+        """Stores a downloaded image"""
+        extension = str(job.attachment.filename).split(".")[-1]
+        if extension.lower() == "gif":
+            # gifs are kept as they are, so they stay animated
+            transform = None
+        else:
+            extension = self.compressor.extension
+            transform = self.compressor.compress
+
+        try:
+            await self.images.put(job.guild_id, job.message_id, job.attachment.id, data, extension, transform=transform)
+        except Exception as e:
+            log.warning(f"Unable to store image {job.attachment.id}: {e}")
 
     async def on_message_edit(self, before, after):
         if before.author != self.bot.user:
@@ -324,6 +336,9 @@ class ModLog(commands.Cog):
     async def on_message_delete(self, message):
         if message.author != self.bot.user:
             await self.event_handler(event=EventFlags.msgDelete, guild=message.guild, before=message)
+            if message.attachments:
+                # the images have been logged, they aren't needed anymore
+                await self.images.release(message.id)
 
     async def on_member_join(self, member):
         await self.event_handler(guild=member.guild, event=EventFlags.memJoin, member=member)
@@ -372,7 +387,7 @@ class ModLog(commands.Cog):
         guild_data = await self.bot.get_guild_data(ctx.guild_id)
         guild_data.channel_mod_log_id = channel.id
 
-        await self.bot.redis.set(guild_data.key, guild_data.to_json())
+        await self.bot.set_guild_data(guild_data)
 
         await ctx.send(f"Set moderation log channel to {channel.mention}", hidden=True)
 
@@ -387,7 +402,7 @@ class ModLog(commands.Cog):
         guild_data = await self.bot.get_guild_data(ctx.guild_id)
         guild_data.channel_mod_log_id = None
 
-        await self.bot.redis.set(guild_data.key, guild_data.to_json())
+        await self.bot.set_guild_data(guild_data)
 
         await ctx.send(f"Disabled moderation logging")
 
@@ -408,7 +423,7 @@ class ModLog(commands.Cog):
 
         guild_data.store_images = toggle
 
-        await self.bot.redis.set(guild_data.key, guild_data.to_json())
+        await self.bot.set_guild_data(guild_data)
         await ctx.send(f"Images are now being {'logged' if toggle else 'ignored'}")
 
 
@@ -1,17 +1,15 @@
-import json
+import asyncio
 import logging
 import traceback
 from datetime import datetime, timedelta
 
 import discord.errors
 import discord.errors
-import pytz
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers import cron
+from discord.ext import tasks
 from discord.ext.commands import BucketType
 from discord_slash import cog_ext
 
-from source import utilities, dataclass, jsonManager
+from source import utilities, dataclass, jsonManager, timers, lease
 from source.shared import *
 
 log: logging.Logger = utilities.getLog("Cog::Mute")
@@ -36,76 +34,147 @@ class Mute(commands.Cog):
 
         self.bot.add_listener(self.on_member_join)
 
-        # i know i could use tasks, however i dont want to use interval scheduling, due to the
-        # chance it can fail if not checked second by second
-        self.scheduler: AsyncIOScheduler = AsyncIOScheduler()  # the task scheduler
+        # one timer per timed mute, all serviced by a single sleeping task
+        self.scheduler: timers.TimerScheduler = timers.TimerScheduler(self._run_job)  # the task scheduler
+
+        # how far ahead of time unmutes are pulled from the expiry index and scheduled
+        self.schedule_window = timedelta(minutes=10)
+
+        # only one process runs the unmutes for each shard, the one holding that shard's lease
+        self.leases: typing.Dict[int, lease.RedisLease] = {}
 
     async def setup(self):
         log.debug("Starting scheduler...")
         self.scheduler.start()
-        await self.cache_and_schedule()
-        log.debug(f"Started scheduler with {len(self.scheduler.get_jobs())} jobs")
+        await self.build_expiry_index()
+
+        for shard_id in self._shard_ids:
+            self.leases[shard_id] = lease.RedisLease(
+                self.bot.redis,
+                f"mute_scheduler||{shard_id}",
+                on_acquire=self.cache_and_schedule,
+            )
+            self.leases[shard_id].start()
+            self.bot.redis.subscribe(f"mute_schedule||{shard_id}", self._on_remote_schedule)
+
+        self.window_task.start()
 
     def cog_unload(self):
         log.debug("Shutting down scheduler")
+        self.window_task.cancel()
         self.scheduler.shutdown(wait=False)
+        for _lease in self.leases.values():
+            asyncio.create_task(_lease.stop())
+
+    async def close(self):
+        """Hand our leases over before the bot closes redis, so another process can take over straight away"""
+        await asyncio.gather(*[_lease.stop() for _lease in self.leases.values()], return_exceptions=True)
+
+    def _shard_id(self, guild_id) -> int:
+        return (int(guild_id) >> 22) % (self.bot.shard_count or 1)
+
+    def _is_leader(self, guild_id) -> bool:
+        """Is this process responsible for running unmutes in this guild"""
+        _lease = self.leases.get(self._shard_id(guild_id))
+        return _lease is not None and _lease.held
+
+    def _on_remote_schedule(self, data: bytes):
+        """Another process has changed a mute, schedule it if we're the leader"""
+        guild_id, user_id, unmute_time = data.decode().split("|")
+        if self._is_leader(guild_id):
+            self._schedule_job(
+                {"guild_id": guild_id, "user_id": user_id, "unmute_time": float(unmute_time) if unmute_time else None}
+            )
 
-    async def cache_and_schedule(self):
-        """Caches guild data and schedules auto-un-mutes"""
-        keys = await self.bot.redis.keys("member||*")
-        for key in keys:
-            data = await self.bot.redis.get(key)
-            raw_data = json.loads(data.decode())
-            await self._schedule_job(raw_data)
-
-    async def _schedule_job(self, user_data: dict):
-        """Schedules a job based on user_data passed"""
+    @tasks.loop(minutes=5)
+    async def window_task(self):
+        """Pulls unmutes from the expiry index before they are due, runs at half the window length"""
         try:
-            job_id = f"{user_data.get('guild_id')}|{user_data.get('user_id')}"
-            run_time: datetime = user_data.get("unmute_time")
-
+            await self.cache_and_schedule()
+        except Exception as e:
+            log.error("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+
+    def _expiry_key(self, guild_id: int) -> str:
+        """The key of the mute expiry index for the shard this guild belongs to"""
+        return f"mute_expiry||{self._shard_id(guild_id)}"
+
+    @property
+    def _shard_ids(self) -> list:
+        """The shards this process is responsible for"""
+        return getattr(self.bot, "shard_ids", None) or [self.bot.shard_id or 0]
+
+    async def build_expiry_index(self):
+        """Builds the per-shard mute expiry indexes from member records
+
+        Only needs to happen once, or when the shard count changes
+        """
+        shard_count = self.bot.shard_count or 1
+        indexed_count = await self.bot.redis.get("migration||mute_expiry")
+        if indexed_count is not None and int(indexed_count) == shard_count:
+            return
+
+        log.info("Building mute expiry index...")
+        if indexed_count is not None:
+            await self.bot.redis.delete(*[f"mute_expiry||{i}" for i in range(int(indexed_count))])
+
+        async def index(user_data: dict):
+            run_time = user_data.get("unmute_time")
+            if not user_data.get("muted") or run_time is None:
+                return
             if isinstance(run_time, str):
                 run_time = datetime.strptime(run_time, "%Y-%m-%d %H:%M:%S.%f")
+            await self.bot.redis.zadd(
+                self._expiry_key(user_data.get("guild_id")),
+                {f"{user_data.get('guild_id')}|{user_data.get('user_id')}": dataclass.Member.encode_field(run_time)},
+            )
 
-            if run_time is not None and run_time <= datetime.utcnow():
-                # bumps events in the past a few seconds into the future
-                # to handle events that should have occurred while the bot
-                # was offline
-                run_time = datetime.utcnow() + timedelta(seconds=10)
-
-            job = self.scheduler.get_job(job_id)
-
-            if run_time is not None:
-                # the trigger for an job
-                trigger = cron.CronTrigger(
-                    year=run_time.year,
-                    month=run_time.month,
-                    day=run_time.day,
-                    hour=run_time.hour,
-                    minute=run_time.minute,
-                    second=run_time.second,
-                    timezone=pytz.utc,
-                )
+        # legacy json records that haven't been migrated to hashes yet
+        async for raw_data in self.bot.redis.iter_scan("member||*"):
+            await index(raw_data)
 
-                if job:
-                    job.reschedule(trigger=trigger)
-                    log.debug(f"Unmute job rescheduled for {run_time.ctime()}")
-                else:
-                    self.scheduler.add_job(
-                        func=self.auto_unmute,
-                        kwargs={"user_id": user_data.get("user_id"), "guild_id": user_data.get("guild_id")},
-                        trigger=trigger,
-                        id=job_id,
-                        name=f"Auto-unmute job for {job_id}",
-                    )
-                    log.debug(f"Unmute job scheduled for {run_time.ctime()}")
-            else:
-                # runtime is none, delete the job
-                if job:
-                    self.scheduler.remove_job(job_id)
-                    log.debug(f"Job deleted due to empty run_time {job_id}")
-        except Exception as e:
-            log.error("Error scheduling job:\n" + "".join(traceback.format_exception(type(e), e, e.__traceback__)))
+        async for raw_data in self.bot.redis.iter_scan("member||*", hashes=True):
+            user_data = dataclass.Member(0, 0)
+            user_data.load_from_hash(raw_data)
+            await index(user_data.__dict__)
+
+        await self.bot.redis.set("migration||mute_expiry", shard_count)
+
+    async def cache_and_schedule(self):
+        """Schedules auto-un-mutes that are due within the next window"""
+        horizon = dataclass.Member.encode_field(datetime.utcnow() + self.schedule_window)
+        for shard_id, _lease in self.leases.items():
+            if not _lease.held:
+                continue
+            due = await self.bot.redis.zrangebyscore(f"mute_expiry||{shard_id}", "-inf", horizon, withscores=True)
+            for member, score in due:
+                guild_id, user_id = member.decode().split("|")
+                self._schedule_job({"guild_id": guild_id, "user_id": user_id, "unmute_time": score})
+
+    def _schedule_job(self, user_data: dict):
+        """Schedules a job based on user_data passed"""
+        job_id = f"{user_data.get('guild_id')}|{user_data.get('user_id')}"
+        run_time: datetime = user_data.get("unmute_time")
+
+        if isinstance(run_time, str):
+            run_time = datetime.strptime(run_time, "%Y-%m-%d %H:%M:%S.%f")
+        elif isinstance(run_time, (int, float)):
+            # expiry index scores and remote schedules are unix timestamps
+            run_time = datetime.utcfromtimestamp(run_time)
+
+        if run_time is not None:
+            # events in the past are fired straight away, in batches
+            self.scheduler.schedule(job_id, run_time)
+            log.debug(f"Unmute job scheduled for {run_time.ctime()}")
+        elif self.scheduler.cancel(job_id):
+            log.debug(f"Job deleted due to empty run_time {job_id}")
+
+    async def _run_job(self, job_id: str):
+        """Called by the scheduler when an unmute is due"""
+        guild_id, user_id = job_id.split("|")
+        if not self._is_leader(guild_id):
+            # we lost the lease since this was scheduled, the new leader will handle it
+            return
+        await self.auto_unmute(user_id=user_id, guild_id=guild_id)
 
     async def auto_unmute(self, user_id, guild_id):
         """Called at a set time to automatically unmute a user"""
@@ -113,48 +182,41 @@ class Mute(commands.Cog):
             log.debug(f"Running unmute task for {guild_id}/{user_id}")
 
             # grab db data to check the user is *actually* due for un-muting
-            guild: discord.Guild = self.bot.get_guild(int(guild_id))
-            user: discord.Member = guild.get_member(int(user_id))
-
-            if not guild or not user:
-                return
-
-            user_data = await self.bot.get_member_data(guild_id, user.id)
+            user_data = await self.bot.get_member_data(guild_id, int(user_id), fields=["muted", "unmute_time"])
 
             # check if user is still muted
             if not user_data.muted:
                 # user has been un-muted already
+                await self.bot.redis.zrem(self._expiry_key(guild_id), f"{guild_id}|{user_id}")
                 return
 
             unmute_time = user_data.unmute_time
-            if not (unmute_time.hour <= datetime.utcnow().hour and unmute_time.minute <= datetime.utcnow().minute):
-                # the job has run at the wrong time
-                # this can occur if the user was re-muted for a new time, but for some reason _schedule_job didnt reschedule it
-                job = self.scheduler.get_job(f"{user_data.guild_id}|{user_data.user_id}")
-                if job:
-                    run_time = user_data.unmute_time
-                    if isinstance(run_time, str):
-                        run_time = datetime.strptime(user_data.unmute_time, "%Y-%m-%d %H:%M:%S.%f")
-                    trigger = cron.CronTrigger(
-                        year=run_time.year,
-                        month=run_time.month,
-                        day=run_time.day,
-                        hour=run_time.hour,
-                        minute=run_time.minute,
-                        second=run_time.second,
-                        timezone=pytz.utc,
-                    )
-                    job.reschedule(trigger)
-                    return log.debug(f"Unmute job rescheduled for {run_time.ctime()}")
+            if unmute_time is None:
+                # user has been re-muted forever
+                return
+            if unmute_time > datetime.utcnow():
+                # the job has run before the user is due to be unmuted
+                # this can occur if the user was re-muted for a longer time on another process
+                self.scheduler.schedule(f"{guild_id}|{user_id}", unmute_time)
+                return log.debug(f"Unmute job rescheduled for {unmute_time.ctime()}")
+
+            # claim this unmute, if another process has already removed it from the index it is handling it
+            # this covers the brief overlap when the lease changes hands
+            if not await self.bot.redis.zrem(self._expiry_key(guild_id), f"{guild_id}|{user_id}"):
                 return
 
+            guild: discord.Guild = self.bot.get_guild(int(guild_id))
+            user: typing.Optional[discord.Member] = guild.get_member(int(user_id)) if guild else None
+            if not user:
+                # the user left, or we left the guild. the mute has expired, so don't re-apply it if they come back
+                log.debug(f"{guild_id}/{user_id} is no longer in the guild, clearing their mute")
+                return await self.bot.set_member_data(int(guild_id), int(user_id), muted=False, unmute_time=None)
+
             # actually unmute
             await user.remove_roles(await self.get_mute_role(guild))
 
             # remove from db
-            user_data.unmute_time = None
-            user_data.muted = False
-            await self.bot.redis.set(user_data.key, user_data.to_json())
+            await self.bot.set_member_data(guild.id, user.id, muted=False, unmute_time=None)
 
             me = guild.get_member(self.bot.user.id)
             await self.bot.paladinEvents.add_item(
@@ -172,13 +234,27 @@ class Mute(commands.Cog):
     async def write_user_to_db(self, user: discord.Member, muted: bool, mute_time: typing.Optional[datetime] = None):
         """Write a users mute status to the database"""
 
-        user_data = await self.bot.get_member_data(guild_id=user.guild.id, user_id=user.id)
-        user_data.muted = muted
-        user_data.unmute_time = mute_time
+        await self.bot.set_member_data(user.guild.id, user.id, muted=muted, unmute_time=mute_time)
+
+        member = f"{user.guild.id}|{user.id}"
+        if muted and mute_time is not None:
+            await self.bot.redis.zadd(
+                self._expiry_key(user.guild.id), {member: dataclass.Member.encode_field(mute_time)}
+            )
+        else:
+            await self.bot.redis.zrem(self._expiry_key(user.guild.id), member)
 
-        await self.bot.redis.set(user_data.key, user_data.to_json())
+        if mute_time is not None and mute_time > datetime.utcnow() + self.schedule_window:
+            # this will be picked up from the index once it is due, drop any job for an older mute
+            mute_time = None
 
-        await self._schedule_job(user_data.__dict__)
+        if self._is_leader(user.guild.id):
+            self._schedule_job({"guild_id": user.guild.id, "user_id": user.id, "unmute_time": mute_time})
+        else:
+            await self.bot.redis.publish(
+                f"mute_schedule||{self._shard_id(user.guild.id)}",
+                f"{user.guild.id}|{user.id}|{dataclass.Member.encode_field(mute_time) if mute_time else ''}",
+            )
 
     async def get_mute_role(self, guild: discord.Guild) -> typing.Optional[discord.Role]:
         """Gets the mute role for a specified guild"""
@@ -199,7 +275,7 @@ class Mute(commands.Cog):
         try:
             guild_data = await self.bot.get_guild_data(ctx.guild.id)
             guild_data.role_mute_id = role.id
-            await self.bot.redis.set(guild_data.key, guild_data.to_json())
+            await self.bot.set_guild_data(guild_data)
         except Exception as e:
             log.error(f"Error setting mute role: {e}")
             return await ctx.send("Failed to set mute role... please try again later")
@@ -305,14 +381,13 @@ class Mute(commands.Cog):
 
     async def on_member_join(self, member: typing.Union[discord.Member, discord.User]):
         """Automatically mute a user if they try and bypass the mute"""
-        user_data = await self.bot.get_member_data(member.guild.id, member.id)
+        user_data = await self.bot.get_member_data(member.guild.id, member.id, fields=["muted", "unmute_time"])
         if user_data:
             if user_data.muted:
                 # user should be muted, check if mute has expired
-                if user_data.unmute_time <= datetime.utcnow():
+                if user_data.unmute_time is not None and user_data.unmute_time <= datetime.utcnow():
                     # mute has expired, dont re-add it
-                    user_data.muted = False
-                    return await self.bot.redis.set(user_data.key, user_data.to_json())
+                    return await self.bot.set_member_data(member.guild.id, member.id, muted=False)
                 else:
                     reason = "AUTOMATIC ACTION: \nRe-applying mute role - user rejoined"
                     role = await self.get_mute_role(member.guild)
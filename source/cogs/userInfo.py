@@ -29,7 +29,7 @@ class UserInfo(commands.Cog):
         emb.description = ""
 
         # get db data on user
-        user_data = await self.bot.get_member_data(ctx.guild.id, user.id)
+        user_data = await self.bot.get_member_data(ctx.guild.id, user.id, fields=["warnings", "muted"])
         user_perms: discord.Permissions = ctx.author.permissions_in(ctx.channel)
         if shared.is_user_moderator(user_perms):
             if user_data:
@@ -27,8 +27,7 @@ class UserWarnings(commands.Cog):
     ):
         """Warns a user, 3 warnings and the user will be kicked"""
         await ctx.defer()
-        user_data = await self.bot.get_member_data(ctx.guild_id, user.id)
-        warning_num = int(user_data.warnings) + 1
+        warning_num = await self.bot.incr_member_data(ctx.guild_id, user.id, "warnings")
 
         embed = discord.Embed(title=f"Warning for {user.name} #{user.discriminator}", color=0xE7C30D)
         embed.add_field(
@@ -87,9 +86,6 @@ class UserWarnings(commands.Cog):
             )
         )
 
-        user_data.warnings = warning_num
-        await self.bot.redis.set(user_data.key, user_data.to_json())
-
     @cog_ext.cog_subcommand(**jsonManager.getDecorator("clear.warn.user"))
     async def warnClearCMD(
         self,
@@ -100,9 +96,7 @@ class UserWarnings(commands.Cog):
         await ctx.defer()
 
         try:
-            user_data = await self.bot.get_member_data(ctx.guild_id, user.id)
-            user_data.warnings = 0
-            await self.bot.redis.set(user_data.key, user_data.to_json())
+            await self.bot.set_member_data(ctx.guild_id, user.id, warnings=0)
 
             await ctx.send(f"Cleared warnings for {user.name} #{user.discriminator}")
         except Exception as e:
@@ -1,4 +1,4 @@
-import json
+import functools
 import logging
 
 import discord
@@ -6,7 +6,7 @@ from discord.ext import commands
 from discord_slash import SlashContext, cog_ext
 from discord_slash.utils import manage_commands
 
-from source import dataclass, utilities
+from source import dataclass, outbound, utilities
 
 log: logging.Logger = utilities.getLog("Cog::Voting")
 
@@ -26,9 +26,7 @@ class VoteChannel(commands.Cog):
 
     async def setup(self):
         log.info("Caching vote channels...")
-        keys = await self.bot.redis.keys("guild||*")
-        for key in keys:
-            data = json.loads(await self.bot.redis.get(key))
+        async for data in self.bot.redis.iter_scan("guild||*"):
             vote_channels = data.get("vote_channel_data") if data.get("vote_channel_data") is not None else None
             if vote_channels is not None:
                 for channel in vote_channels:
@@ -46,10 +44,16 @@ class VoteChannel(commands.Cog):
                     guild_data = await self.bot.get_guild_data(message.guild.id)
                     guild_data.vote_channel_data.remove(message.channel.id)
 
-                    return await self.bot.redis.set(guild_data.key, guild_data.to_json())
+                    return await self.bot.set_guild_data(guild_data)
 
-                await message.add_reaction(self.emoji["checkMark"])
-                await message.add_reaction(self.emoji["crossMark"])
+                for emoji in (self.emoji["checkMark"], self.emoji["crossMark"]):
+                    await self.bot.outbound.send(
+                        "PUT",
+                        f"/channels/{message.channel.id}/messages/{message.id}/reactions/{emoji}/@me",
+                        functools.partial(message.add_reaction, emoji),
+                        guild_id=message.guild.id,
+                        priority=outbound.Priority.interactive,
+                    )
 
     @cog_ext.cog_subcommand(
         base="set-channel",
@@ -83,7 +87,7 @@ class VoteChannel(commands.Cog):
         if channel.id not in guild_data.vote_channel_data:
             guild_data.vote_channel_data.append(channel.id)
         self.cache.add(channel.id)
-        await self.bot.redis.set(guild_data.key, guild_data.to_json())
+        await self.bot.set_guild_data(guild_data)
 
         await ctx.send(f"New messages sent in {channel.mention} will now have vote reactions added")
 
@@ -116,7 +120,7 @@ class VoteChannel(commands.Cog):
 
         guild_data.vote_channel_data.remove(channel.id)
         self.cache.remove(channel.id)
-        await self.bot.redis.set(guild_data.key, guild_data.to_json())
+        await self.bot.set_guild_data(guild_data)
 
         await ctx.send(f"Vote reactions in {channel.mention} have been disabled")
 
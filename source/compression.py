@@ -0,0 +1,86 @@
+import asyncio
+import io
+import typing
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from source import utilities
+
+log = utilities.getLog("compression")
+
+formats = {"webp": "webp", "jpeg": "jpg"}
+"""Supported output formats, and the extension they are saved with"""
+
+
+def compress(data: bytes, image_format: str = "webp", quality: int = 60, max_size: int = 1920) -> bytes:
+    """Downscale and re-encode an image, runs inside a worker process"""
+    with Image.open(io.BytesIO(data)) as image:
+        # we dont want to save huge images, so downscale all images to fit within max_size x max_size
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+
+        if image_format == "jpeg" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGBA")
+
+        output = io.BytesIO()
+        if image_format == "webp":
+            image.save(output, format="WEBP", quality=quality, method=4)
+        else:
+            image.save(output, format="JPEG", quality=quality, optimize=True)
+        return output.getvalue()
+
+
+class CompressionPipeline:
+    """
+    Compresses images in a pool of worker processes, so Pillow never holds the GIL the event loop needs
+
+    :param workers how many processes to use, defaults to one per cpu
+    :param max_pending the most images queued or compressing at once, anything more waits for space
+    :param image_format the format images are saved as, "webp" or "jpeg"
+    :param quality the quality images are saved with, 0-100
+    :param max_size images are downscaled to fit within max_size x max_size
+    """
+
+    def __init__(
+        self,
+        workers: typing.Optional[int] = None,
+        max_pending: int = 64,
+        image_format: str = "webp",
+        quality: int = 60,
+        max_size: int = 1920,
+    ):
+        if image_format not in formats:
+            raise ValueError(f"Unsupported image format {image_format}, expected one of {', '.join(formats)}")
+        self.workers = workers
+        self.max_pending = max_pending
+        self.image_format = image_format
+        self.quality = quality
+        self.max_size = max_size
+
+        self._executor: typing.Optional[ProcessPoolExecutor] = None
+        self._pending: typing.Optional[asyncio.Semaphore] = None
+
+    @property
+    def extension(self) -> str:
+        """The extension compressed images should be saved with"""
+        return formats[self.image_format]
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers)
+            self._pending = asyncio.Semaphore(self.max_pending)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def compress(self, data: bytes) -> bytes:
+        """Compress an image, waits for space if the pipeline is full"""
+        self.start()
+        async with self._pending:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, compress, data, self.image_format, self.quality, self.max_size
+            )
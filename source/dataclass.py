@@ -3,49 +3,405 @@ import copy
 import json
 import logging
 import subprocess
+import time
 import typing
+import uuid
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from pprint import pprint
 
 import discord
 import discord_slash
 import redis
+import redis.asyncio as aioredis
 import toml
 from discord.ext import commands
 from discord_slash import SlashContext
 from discord_slash.utils import manage_commands
 
-from source import events, monkeypatch, utilities
+from source import eventStream, events, monkeypatch, outbound, snowflake, utilities, webhooks
 
 
 class AsyncRedis:
-    def __init__(self, host="localhost", port=6379, db=0):
+    """A thin asyncio wrapper around redis
+
+    Connections are drawn from a shared pool, and the first command lazily connects (with retries)
+    rather than blocking the event loop on startup
+    """
+
+    def __init__(self, host="localhost", port=6379, db=0, max_connections=64, retries=5, retry_delay=1):
         self.log = utilities.getLog("Redis", logging.INFO)
 
-        self.log.info("Connecting to redis...")
-        self.__redis = redis.Redis(host=host, port=port, db=db)
+        self.retries = retries
+        """How many times to attempt to connect before giving up"""
 
-        try:
-            self.__redis.ping()
-        except Exception as e:
-            self.log.critical(e)
-            exit(1)
+        self.retry_delay = retry_delay
+        """The initial delay between connection attempts, doubles after each failure"""
+
+        self.__pool = aioredis.ConnectionPool(host=host, port=port, db=db, max_connections=max_connections)
+        self.__redis = aioredis.Redis(connection_pool=self.__pool)
+
+        self._connected = False
+        self._connect_lock: typing.Optional[asyncio.Lock] = None
+
+        self._subscriptions: typing.List[asyncio.Task] = []
+
+    async def connect(self):
+        """Connect to redis, retrying with a backoff if redis is unavailable"""
+        if self._connected:
+            return
+
+        # the lock is created here, as the loop may not exist when __init__ is called
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+
+        async with self._connect_lock:
+            if self._connected:
+                return
+
+            delay = self.retry_delay
+            for attempt in range(1, self.retries + 1):
+                try:
+                    self.log.info("Connecting to redis...")
+                    await self.__redis.ping()
+                    self._connected = True
+                    return self.log.info("Connected to redis")
+                except (redis.ConnectionError, redis.TimeoutError, OSError) as e:
+                    if attempt == self.retries:
+                        self.log.critical(f"Unable to connect to redis after {attempt} attempts: {e}")
+                        raise
+                    self.log.warning(f"Failed to connect to redis ({e}), retrying in {delay}s")
+                    await asyncio.sleep(delay)
+                    delay *= 2
+
+    async def _client(self) -> aioredis.Redis:
+        """Gets the redis client, connecting if necessary"""
+        if not self._connected:
+            await self.connect()
+        return self.__redis
 
     async def set(self, key, value, ex=None, px=None, nx=False, xx=False, keepttl=False):
         self.log.debug(f"SET:: {key=} {value=} {ex=} {px=} {nx=} {xx=} {keepttl=}")
-        return await asyncio.to_thread(self.__redis.set, key, value, ex=ex, px=px, nx=nx, xx=xx, keepttl=keepttl)
+        client = await self._client()
+        return await client.set(key, value, ex=ex, px=px, nx=nx, xx=xx, keepttl=keepttl)
 
     async def get(self, key):
         self.log.debug(f"GET:: {key=}")
-        return await asyncio.to_thread(self.__redis.get, key)
+        client = await self._client()
+        return await client.get(key)
+
+    async def delete(self, *keys):
+        self.log.debug(f"DEL:: {keys=}")
+        client = await self._client()
+        return await client.delete(*keys)
+
+    async def hgetall(self, key):
+        self.log.debug(f"HGETALL:: {key=}")
+        client = await self._client()
+        return await client.hgetall(key)
+
+    async def hmget(self, key, fields):
+        self.log.debug(f"HMGET:: {key=} {fields=}")
+        client = await self._client()
+        return await client.hmget(key, fields)
+
+    async def hset(self, key, mapping):
+        self.log.debug(f"HSET:: {key=} {mapping=}")
+        client = await self._client()
+        return await client.hset(key, mapping=mapping)
+
+    async def hdel(self, key, *fields):
+        self.log.debug(f"HDEL:: {key=} {fields=}")
+        client = await self._client()
+        return await client.hdel(key, *fields)
+
+    async def hincrby(self, key, field, amount=1):
+        self.log.debug(f"HINCRBY:: {key=} {field=} {amount=}")
+        client = await self._client()
+        return await client.hincrby(key, field, amount)
+
+    async def rpush(self, key, *values):
+        self.log.debug(f"RPUSH:: {key=} {len(values)=}")
+        client = await self._client()
+        return await client.rpush(key, *values)
+
+    async def lrange(self, key, start, end):
+        self.log.debug(f"LRANGE:: {key=} {start=} {end=}")
+        client = await self._client()
+        return await client.lrange(key, start, end)
+
+    async def ltrim(self, key, start, end):
+        self.log.debug(f"LTRIM:: {key=} {start=} {end=}")
+        client = await self._client()
+        return await client.ltrim(key, start, end)
+
+    async def zadd(self, key, mapping):
+        self.log.debug(f"ZADD:: {key=} {mapping=}")
+        client = await self._client()
+        return await client.zadd(key, mapping)
+
+    async def zrem(self, key, *members):
+        self.log.debug(f"ZREM:: {key=} {members=}")
+        client = await self._client()
+        return await client.zrem(key, *members)
+
+    async def zrangebyscore(self, key, min, max, start=None, num=None, withscores=False):
+        self.log.debug(f"ZRANGEBYSCORE:: {key=} {min=} {max=} {start=} {num=}")
+        client = await self._client()
+        return await client.zrangebyscore(key, min, max, start=start, num=num, withscores=withscores)
+
+    async def zremrangebyscore(self, key, min, max):
+        self.log.debug(f"ZREMRANGEBYSCORE:: {key=} {min=} {max=}")
+        client = await self._client()
+        return await client.zremrangebyscore(key, min, max)
+
+    async def sadd(self, key, *members):
+        self.log.debug(f"SADD:: {key=} {members=}")
+        client = await self._client()
+        return await client.sadd(key, *members)
+
+    async def srem(self, key, *members):
+        self.log.debug(f"SREM:: {key=} {members=}")
+        client = await self._client()
+        return await client.srem(key, *members)
+
+    async def sismember(self, key, member):
+        self.log.debug(f"SISMEMBER:: {key=} {member=}")
+        client = await self._client()
+        return await client.sismember(key, member)
+
+    async def xadd(self, name, fields, maxlen=None):
+        self.log.debug(f"XADD:: {name=} {fields=} {maxlen=}")
+        client = await self._client()
+        return await client.xadd(name, fields, maxlen=maxlen, approximate=True)
+
+    async def xgroup_create(self, name, group, id="$"):
+        """Create a consumer group (and the stream), returns False if it already exists"""
+        self.log.debug(f"XGROUP CREATE:: {name=} {group=} {id=}")
+        client = await self._client()
+        try:
+            return await client.xgroup_create(name, group, id=id, mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+            return False
+
+    async def xreadgroup(self, group, consumer, streams, count=None, block=None):
+        self.log.debug(f"XREADGROUP:: {group=} {consumer=} {streams=} {count=} {block=}")
+        client = await self._client()
+        return await client.xreadgroup(group, consumer, streams, count=count, block=block)
+
+    async def xack(self, name, group, *ids):
+        self.log.debug(f"XACK:: {name=} {group=} {ids=}")
+        client = await self._client()
+        return await client.xack(name, group, *ids)
+
+    async def xautoclaim(self, name, group, consumer, min_idle_time, start_id="0-0", count=None):
+        self.log.debug(f"XAUTOCLAIM:: {name=} {group=} {consumer=} {min_idle_time=} {start_id=}")
+        client = await self._client()
+        return await client.xautoclaim(name, group, consumer, min_idle_time, start_id=start_id, count=count)
+
+    async def eval(self, script, numkeys, *keys_and_args):
+        self.log.debug(f"EVAL:: {numkeys=} {keys_and_args=}")
+        client = await self._client()
+        return await client.eval(script, numkeys, *keys_and_args)
+
+    async def pipeline(self, transaction=True):
+        """Get a pipeline, use as an async context manager"""
+        client = await self._client()
+        return client.pipeline(transaction=transaction)
+
+    async def incr(self, key, amount=1):
+        self.log.debug(f"INCR:: {key=} {amount=}")
+        client = await self._client()
+        return await client.incr(key, amount)
 
     async def keys(self, pattern):
         self.log.debug(f"KEYS:: {pattern=}")
-        return await asyncio.to_thread(self.__redis.keys, pattern)
+        client = await self._client()
+        return await client.keys(pattern)
+
+    async def iter_scan(self, pattern, batch=1000, hashes=False) -> typing.AsyncIterator[dict]:
+        """Iterate over the json records matching a pattern without blocking redis
+
+        Keys are found with SCAN, and each page is fetched with one MGET pipelined alongside the next SCAN,
+        so every page costs a single round trip.
+        If `hashes` is set, hash records are fetched with HGETALL instead and yielded as dicts of str
+        """
+        self.log.debug(f"SCAN:: {pattern=} {batch=} {hashes=}")
+        client = await self._client()
+
+        cursor, keys = await client.scan(0, match=pattern, count=batch)
+        while keys or cursor != 0:
+            async with client.pipeline(transaction=False) as pipe:
+                if keys and hashes:
+                    for key in keys:
+                        pipe.hgetall(key)
+                elif keys:
+                    pipe.mget(keys)
+                if cursor != 0:
+                    pipe.scan(cursor, match=pattern, count=batch)
+                results = await pipe.execute(raise_on_error=False)
+
+            if hashes:
+                values = results[: len(keys)]
+                results = results[len(keys) :]
+            else:
+                values = results.pop(0) if keys else []
+
+            for value in values:
+                # the key was deleted between the SCAN and fetch, or holds a different type
+                if not value or isinstance(value, Exception):
+                    continue
+                if hashes:
+                    yield {k.decode(): v.decode() for k, v in value.items()}
+                else:
+                    yield json.loads(value.decode())
+
+            if cursor == 0:
+                break
+            cursor, keys = results[0]
+
+    async def scan_iter(self, pattern, batch=1000) -> typing.AsyncIterator[bytes]:
+        """Iterate over the keys matching a pattern with SCAN, without blocking redis like KEYS"""
+        self.log.debug(f"SCAN:: {pattern=} {batch=}")
+        client = await self._client()
+        async for key in client.scan_iter(match=pattern, count=batch):
+            yield key
 
     async def ping(self):
         self.log.debug(f"PING:: None")
-        return await asyncio.to_thread(self.__redis.ping)
+        client = await self._client()
+        return await client.ping()
+
+    async def publish(self, channel, message):
+        self.log.debug(f"PUBLISH:: {channel=} {message=}")
+        client = await self._client()
+        return await client.publish(channel, message)
+
+    def subscribe(
+        self,
+        channel: str,
+        callback: typing.Callable[[bytes], typing.Any],
+        on_reconnect: typing.Optional[typing.Callable[[], typing.Any]] = None,
+    ) -> asyncio.Task:
+        """Subscribe to a pub/sub channel, calling `callback` with the data of each message
+
+        The subscription is re-established if the connection drops, `on_reconnect` is called when that
+        happens as messages may have been missed
+        """
+        task = asyncio.create_task(self._listen(channel, callback, on_reconnect))
+        self._subscriptions.append(task)
+        return task
+
+    async def _listen(self, channel, callback, on_reconnect):
+        first = True
+        while True:
+            try:
+                client = await self._client()
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(channel)
+                    if not first and on_reconnect is not None:
+                        on_reconnect()
+                    first = False
+                    self.log.debug(f"SUBSCRIBE:: {channel=}")
+
+                    async for message in pubsub.listen():
+                        if message["type"] != "message":
+                            continue
+                        try:
+                            callback(message["data"])
+                        except Exception as e:
+                            self.log.error(f"Error handling message on {channel}: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log.warning(f"Subscription to {channel} lost ({e}), re-subscribing")
+                await asyncio.sleep(self.retry_delay)
+
+    async def close(self):
+        """Close all connections in the pool"""
+        for task in self._subscriptions:
+            task.cancel()
+        self._subscriptions = []
+
+        await self.__redis.close()
+        await self.__pool.disconnect()
+        self._connected = False
+
+
+class GuildCache:
+    """A bounded LRU cache of Guild objects, entries expire after `ttl` seconds
+
+    Copies are stored and returned, so callers are free to mutate the object they get back.
+    Reads from the db take a `version()` first, so a result that was invalidated while in flight isn't cached
+    """
+
+    def __init__(self, max_size: int = 4096, ttl: float = 600):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._data: "OrderedDict[int, typing.Tuple[float, Guild]]" = OrderedDict()
+
+        # bumped by every write and invalidation, guild id -> the clock when its cached data was last superseded
+        self._clock = 0
+        self._superseded: typing.Dict[int, int] = {}
+        self._cleared = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, guild_id: int) -> typing.Optional["Guild"]:
+        """Get a copy of a cached guild, or None if it isn't cached"""
+        entry = self._data.get(guild_id)
+        if entry is None:
+            return None
+
+        stored_at, guild = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._data[guild_id]
+            return None
+
+        self._data.move_to_end(guild_id)
+        return copy.deepcopy(guild)
+
+    def version(self) -> int:
+        """Take before reading a guild from the db, and pass to `put`"""
+        return self._clock
+
+    def _supersede(self, guild_id: int):
+        self._clock += 1
+        self._superseded[guild_id] = self._clock
+
+    def put(self, guild: "Guild", version: typing.Optional[int] = None) -> bool:
+        """Store a copy of a guild, evicting the least recently used entry if full
+
+        :param version if given, this is the result of a read, and is dropped if the guild was written or
+            invalidated since the version was taken
+        :returns if the guild was stored
+        """
+        if version is None:
+            # a write, reads still in flight are older than this
+            self._supersede(guild.guild_id)
+        elif self._superseded.get(guild.guild_id, 0) > version or self._cleared > version:
+            return False
+
+        self._data[guild.guild_id] = (time.monotonic(), copy.deepcopy(guild))
+        self._data.move_to_end(guild.guild_id)
+
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+        return True
+
+    def invalidate(self, guild_id: int):
+        self._supersede(guild_id)
+        self._data.pop(guild_id, None)
+
+    def clear(self):
+        self._clock += 1
+        self._cleared = self._clock
+        self._superseded.clear()
+        self._data.clear()
 
 
 class Guild:
@@ -134,6 +490,38 @@ class Member:
         if self.unmute_time is not None:
             self.unmute_time = datetime.strptime(self.unmute_time, "%Y-%m-%d %H:%M:%S.%f")
 
+    @staticmethod
+    def encode_field(value) -> typing.Union[int, float, str]:
+        """Encode a value to be stored in a redis hash"""
+        if isinstance(value, bool):
+            return int(value)
+        if isinstance(value, datetime):
+            # unmute times are naive utc
+            return (value - datetime(1970, 1, 1)).total_seconds()
+        return value
+
+    def to_hash(self) -> dict:
+        """Dump this object to a mapping ready for HSET, unset fields are omitted"""
+        return {key: self.encode_field(value) for key, value in self.__dict__.items() if value is not None}
+
+    def load_from_hash(self, raw_data: dict):
+        """Load values from a redis hash, keys and values may be bytes or str"""
+        for key, value in raw_data.items():
+            key = key.decode() if isinstance(key, bytes) else key
+            value = value.decode() if isinstance(value, bytes) else value
+            if key in member_field_decoders:
+                self.__setattr__(key, member_field_decoders[key](value))
+
+
+member_field_decoders = {
+    "guild_id": int,
+    "user_id": int,
+    "warnings": int,
+    "muted": lambda v: v == "1",
+    "unmute_time": lambda v: datetime.utcfromtimestamp(float(v)),
+}
+"""How to decode each field of a member hash"""
+
 
 class ModAction:
     """An object representing a moderation action"""
@@ -175,13 +563,34 @@ class Bot(commands.Bot):
     Expands on the default bot class, and helps with type-hinting
     """
 
-    def __init__(self, cogList=list, *args, **kwargs):
+    def __init__(self, cogList=list, durable_events=False, consume_events=True, worker_id="0", *args, **kwargs):
         self.cogList = cogList
         """A list of cogs to be mounted"""
 
+        self.worker_id = str(worker_id)
+        """Identifies this process among those on the same host, must be unique to it and stable across restarts"""
+
         self.redis = AsyncRedis()
         """The bots database"""
 
+        self.guild_cache = GuildCache()
+        """An in-memory cache of guild data, kept coherent with other processes via pub/sub"""
+
+        self.webhooks = webhooks.WebhookCache(self)
+        """The webhooks the bot sends through, by channel"""
+
+        self.outbound = outbound.OutboundScheduler()
+        """Schedules sends to discord around their rate limits"""
+
+        self.recent_messages = snowflake.ChannelIndex()
+        """The ids of recent messages in each channel, maintained by BaseModeration"""
+
+        self.log_batcher = webhooks.WebhookBatcher(self, "Moderation Log")
+        """Batches embeds sent to mod log channels"""
+
+        self.instance_id = uuid.uuid4().hex
+        """A unique id for this process, used to ignore our own cache invalidations"""
+
         self.appInfo: discord.AppInfo = None
         """A cached application info"""
 
@@ -195,6 +604,9 @@ class Bot(commands.Bot):
         """The perms the bot needs"""
 
         self.paladinEvents: events.PaladinEvents = events.PaladinEvents()
+        if durable_events:
+            # mod actions are published to a redis stream, and only consumed if `consume_events` is set
+            self.paladinEvents.stream = eventStream.RedisEventStream(self, consume=consume_events)
 
         emoji = open("data/emoji.json", "r")
         self.emoji_list = json.load(emoji)
@@ -226,6 +638,11 @@ class Bot(commands.Bot):
         return True
 
     async def get_guild_data(self, guild_id: int) -> Guild:
+        data = self.guild_cache.get(guild_id)
+        if data is not None:
+            return data
+
+        version = self.guild_cache.version()
         data = await self.redis.get(f"guild||{guild_id}")
         if data is None:
             data = Guild(guild_id)
@@ -234,8 +651,37 @@ class Bot(commands.Bot):
             data = Guild(raw_data.get("guild_id"))
             data.load_from_dict(raw_data)
 
+        self.guild_cache.put(data, version)
         return data
 
+    async def set_guild_data(self, guild_data: Guild):
+        """Write guild data to the db, updating the cache and invalidating it in other processes"""
+        await self.redis.set(guild_data.key, guild_data.to_json())
+        self.guild_cache.put(guild_data)
+        await self.redis.publish("cache||guild", f"{self.instance_id}||{guild_data.guild_id}")
+
+    async def cache_all_guild_data(self):
+        """Load data for every guild this bot is in into the cache"""
+        version = self.guild_cache.version()
+        async for raw_data in self.redis.iter_scan("guild||*"):
+            guild_id = raw_data.get("guild_id")
+            if self.get_guild(guild_id) is None:
+                continue
+            data = Guild(guild_id)
+            data.load_from_dict(raw_data)
+            self.guild_cache.put(data, version)
+
+    def _on_guild_invalidation(self, data: bytes):
+        """Called when any process writes guild data"""
+        instance_id, guild_id = data.decode().split("||")
+        if instance_id != self.instance_id:
+            self.guild_cache.invalidate(int(guild_id))
+
+    def start_cache_invalidation(self):
+        """Listen for guild data writes from other processes"""
+        # if the subscription drops we may have missed invalidations, so start from scratch
+        self.redis.subscribe("cache||guild", self._on_guild_invalidation, on_reconnect=self.guild_cache.clear)
+
     async def get_action_data(self, guild_id: int, action_id: int) -> ModAction:
         data = await self.redis.get(f"action||{guild_id}{action_id}")
         if data is None:
@@ -247,17 +693,93 @@ class Bot(commands.Bot):
 
         return data
 
-    async def get_member_data(self, guild_id: int, user_id: int) -> Member:
-        data = await self.redis.get(f"member||{guild_id}{user_id}")
-        if data is None:
-            data = Member(guild_id, user_id)
-        else:
-            raw_data = json.loads(data.decode())
-            data = Member(guild_id, user_id)
-            data.load_from_dict(raw_data)
+    async def get_member_data(
+        self, guild_id: int, user_id: int, fields: typing.Optional[typing.List[str]] = None
+    ) -> Member:
+        """Get a member's data, if `fields` is passed only those fields are fetched, the rest are left default"""
+        data = Member(guild_id, user_id)
+        try:
+            if fields:
+                values = await self.redis.hmget(data.key, fields)
+                data.load_from_hash({field: value for field, value in zip(fields, values) if value is not None})
+            else:
+                data.load_from_hash(await self.redis.hgetall(data.key))
+        except redis.ResponseError as e:
+            if "WRONGTYPE" not in str(e):
+                raise
+            await self._migrate_member_data(data)
 
         return data
 
+    async def _migrate_member_data(self, data: Member):
+        """Converts a legacy json member record into a hash, loading its values into `data`
+
+        Two callers can hit the same legacy record at once, so the conversion is done under WATCH,
+        and a record someone else has already converted is just loaded
+        """
+        async with await self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    await pipe.watch(data.key)
+                    key_type = await pipe.type(data.key)
+                    if key_type == b"hash":
+                        data.load_from_hash(await pipe.hgetall(data.key))
+                        await pipe.reset()
+                        return
+
+                    raw_data = await pipe.get(data.key) if key_type == b"string" else None
+                    if raw_data is not None:
+                        data.load_from_dict(json.loads(raw_data.decode()))
+
+                    pipe.multi()
+                    pipe.delete(data.key)
+                    pipe.hset(data.key, mapping=data.to_hash())
+                    await pipe.execute()
+                    return
+                except redis.WatchError:
+                    # the record changed under us, most likely converted by another caller
+                    continue
+
+    async def set_member_data(self, guild_id: int, user_id: int, **fields):
+        """Set fields on a member's record in one round trip, fields set to None are removed"""
+        data = Member(guild_id, user_id)
+        mapping = {"guild_id": guild_id, "user_id": user_id}
+        mapping.update({key: Member.encode_field(value) for key, value in fields.items() if value is not None})
+        removed = [key for key, value in fields.items() if value is None]
+
+        async def _set():
+            async with await self.redis.pipeline() as pipe:
+                pipe.hset(data.key, mapping=mapping)
+                if removed:
+                    pipe.hdel(data.key, *removed)
+                await pipe.execute()
+
+        try:
+            await _set()
+        except redis.ResponseError as e:
+            if "WRONGTYPE" not in str(e):
+                raise
+            await self._migrate_member_data(data)
+            await _set()
+
+    async def incr_member_data(self, guild_id: int, user_id: int, field: str, amount: int = 1) -> int:
+        """Atomically increment a field on a member's record, returns the new value"""
+        data = Member(guild_id, user_id)
+
+        async def _incr():
+            async with await self.redis.pipeline() as pipe:
+                pipe.hset(data.key, mapping={"guild_id": guild_id, "user_id": user_id})
+                pipe.hincrby(data.key, field, amount)
+                return (await pipe.execute())[-1]
+
+        try:
+            return await _incr()
+        except redis.ResponseError as e:
+            if "WRONGTYPE" not in str(e):
+                raise
+            await self._migrate_member_data(data)
+            return await _incr()
+
     async def add_permissions_to_commands(self, sync=False):
         perms_data = {}
         for guild in self.guilds:
@@ -281,6 +803,14 @@ class Bot(commands.Bot):
     async def close(self):
         """Close the connection to discord"""
 
+        # give cogs a chance to clean up while redis is still open, cog_unload can't be awaited
+        for cog in tuple(self.cogs.values()):
+            if hasattr(cog, "close"):
+                try:
+                    await cog.close()
+                except Exception:
+                    pass
+
         for extension in tuple(self.extensions):
             try:
                 self.unload_extension(extension)
@@ -293,23 +823,21 @@ class Bot(commands.Bot):
                 if hasattr(_c, "scheduler"):
                     # cog has a scheduler, shut it down
                     _c.scheduler.shutdown(wait=False)
-                    while not _c.scheduler.running:
+                    while _c.scheduler.running:
                         await asyncio.sleep(1)
                 self.remove_cog(cog)
             except Exception:
                 pass
 
         # let the event loops close gracefully
-        while not self.paladinEvents._queue.empty():
-            await asyncio.sleep(0)
-        self.paladinEvents.process = False
-        if self.paladinEvents.task is not None:
-            while not self.paladinEvents.task.done():
-                await asyncio.sleep(0)
+        await self.paladinEvents.shutdown()
+        await self.log_batcher.close()
+        await self.outbound.close()
 
         if self._closed:
             return
 
+        await self.redis.close()
         await self.http.close()
         self._closed = True
 
@@ -0,0 +1,121 @@
+import asyncio
+import traceback
+import typing
+
+import aiohttp
+import discord
+
+from source import utilities
+
+log = utilities.getLog("downloads")
+
+
+class DownloadTooLarge(Exception):
+    """The download was bigger than the pool allows"""
+
+
+class DownloadJob(typing.NamedTuple):
+    guild_id: int
+    message_id: int
+    attachment: discord.Attachment
+
+
+class DownloadPool:
+    """
+    Downloads attachments with a fixed number of workers, so listeners can queue a download and return straight away
+
+    Downloads use the pool's own http session, opened by `start` and closed by `close`
+
+    :param handler called with each job and its downloaded bytes
+    :param workers how many downloads run at once
+    :param max_queue the most jobs waiting, jobs submitted while the queue is full are dropped
+    :param max_bytes downloads larger than this are abandoned
+    :param timeout how long, in seconds, a download may take
+    """
+
+    def __init__(
+        self,
+        handler: typing.Callable[[DownloadJob, bytes], typing.Awaitable],
+        workers: int = 4,
+        max_queue: int = 256,
+        max_bytes: int = 8 * 1024 * 1024,
+        timeout: float = 60,
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+
+        self._session: typing.Optional[aiohttp.ClientSession] = None
+        self._queue: typing.Optional[asyncio.Queue] = None
+        self._tasks: typing.List[asyncio.Task] = []
+
+        # metrics
+        self.dropped = 0
+        self.too_large = 0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self._queue = asyncio.Queue(self.max_queue)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        """Stop the workers and close the session, anything still queued is dropped"""
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def submit(self, guild_id: int, message_id: int, attachment: discord.Attachment) -> bool:
+        """Queue an attachment to be downloaded, returns False if it was dropped"""
+        if attachment.size > self.max_bytes:
+            self.too_large += 1
+            return False
+        try:
+            self._queue.put_nowait(DownloadJob(guild_id, message_id, attachment))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                log.warning(f"Download queue full, {self.dropped} downloads dropped so far")
+            return False
+        return True
+
+    async def _download(self, url: str) -> bytes:
+        """Stream a file, giving up as soon as it is larger than `max_bytes`"""
+        async with self._session.get(url) as response:
+            response.raise_for_status()
+            if response.content_length is not None and response.content_length > self.max_bytes:
+                raise DownloadTooLarge()
+
+            chunks = []
+            size = 0
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise DownloadTooLarge()
+                chunks.append(chunk)
+            return b"".join(chunks)
+
+    async def _worker(self):
+        while True:
+            job: DownloadJob = await self._queue.get()
+            try:
+                data = await self._download(job.attachment.url)
+                await self.handler(job, data)
+            except DownloadTooLarge:
+                self.too_large += 1
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                log.warning(f"Unable to download attachment {job.attachment.id}: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,150 @@
+import asyncio
+import socket
+import traceback
+import typing
+
+from source import events, shared, utilities
+
+log = utilities.getLog("eventStream")
+
+
+class RedisEventStream:
+    """
+    A durable transport for paladin actions, backed by a redis stream
+
+    Actions are XADDed when published, and read back through a consumer group. Entries are only acknowledged
+    once their subscribers have run, so anything a process didn't finish is replayed when it restarts, or
+    claimed by another consumer once it has been idle for `claim_idle` ms.
+
+    :param bot the bot
+    :param stream the key of the stream
+    :param group the consumer group, every process in the group shares the work
+    :param consumer the name of this consumer, must be unique to this process and stable across restarts, so only
+        its own pending entries are replayed. Defaults to the hostname and the bot's worker id
+    :param consume if False this process only publishes, and log writing is left to other processes
+    :param maxlen roughly how many entries the stream keeps
+    :param claim_idle how long, in ms, an entry may be pending before another consumer claims it
+    """
+
+    def __init__(
+        self,
+        bot,
+        stream: str = "events||paladin",
+        group: str = "paladin",
+        consumer: typing.Optional[str] = None,
+        consume: bool = True,
+        maxlen: int = 100_000,
+        claim_idle: int = 60_000,
+    ):
+        self.bot = bot
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer or f"paladin-{socket.gethostname()}-{bot.worker_id}"
+        self.consume = consume
+        self.maxlen = maxlen
+        self.claim_idle = claim_idle
+
+        self.task: typing.Optional[asyncio.Task] = None
+
+        # entries queued locally but not yet acknowledged, so a slow backlog isn't claimed back and queued twice
+        self._held: typing.Set[bytes] = set()
+
+    async def publish(self, action: shared.ActionRecord):
+        """Add an action to the stream"""
+        await self.bot.redis.xadd(self.stream, {"data": action.encode()}, maxlen=self.maxlen)
+
+    async def ack(self, entry_id: bytes):
+        await self.bot.redis.xack(self.stream, self.group, entry_id)
+        self._held.discard(entry_id)
+
+    def release(self, entry_id: bytes):
+        """Forget a queued entry without acknowledging it, it is claimed and queued again once idle"""
+        self._held.discard(entry_id)
+
+    def start(self, paladin_events: events.PaladinEvents):
+        """Start feeding entries from the stream into `paladin_events`"""
+        if not self.consume:
+            return
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._consume(paladin_events))
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _queue_entries(self, paladin_events: events.PaladinEvents, entries: list) -> int:
+        """Decode entries and queue them for dispatch, returns how many were queued"""
+        queued = 0
+        for entry_id, fields in entries:
+            if entry_id in self._held:
+                continue
+            if not fields:
+                # the entry was trimmed from the stream while pending
+                await self.ack(entry_id)
+                continue
+            try:
+                action = shared.ActionRecord.decode(fields[b"data"])
+            except Exception as e:
+                log.error(f"Unable to decode entry {entry_id}: {e}")
+                action = None
+
+            if action is None:
+                # nothing can be done with this entry, don't let it be redelivered forever
+                await self.ack(entry_id)
+                continue
+
+            self._held.add(entry_id)
+            await paladin_events.add_item(events.StreamEntry(entry_id, action))
+            queued += 1
+        return queued
+
+    async def _replay(self, paladin_events: events.PaladinEvents):
+        """Queue entries this consumer was delivered but never acknowledged"""
+        last_id = "0"
+        while True:
+            response = await self.bot.redis.xreadgroup(self.group, self.consumer, {self.stream: last_id}, count=100)
+            entries = response[0][1] if response else []
+            if not entries:
+                return
+            await self._queue_entries(paladin_events, entries)
+            last_id = entries[-1][0]
+
+    async def _claim(self, paladin_events: events.PaladinEvents):
+        """Claim entries left pending by consumers that have stopped"""
+        start_id = "0-0"
+        while True:
+            response = await self.bot.redis.xautoclaim(
+                self.stream, self.group, self.consumer, self.claim_idle, start_id=start_id, count=100
+            )
+            start_id, entries = response[0], response[1]
+            if entries:
+                log.info(f"Claimed {len(entries)} idle entries")
+                await self._queue_entries(paladin_events, entries)
+            if start_id in (b"0-0", "0-0"):
+                return
+
+    async def _consume(self, paladin_events: events.PaladinEvents):
+        await self.bot.redis.xgroup_create(self.stream, self.group, id="0")
+
+        await self._replay(paladin_events)
+        await self._claim(paladin_events)
+
+        last_claim = asyncio.get_running_loop().time()
+        while True:
+            try:
+                response = await self.bot.redis.xreadgroup(
+                    self.group, self.consumer, {self.stream: ">"}, count=100, block=5000
+                )
+                if response:
+                    await self._queue_entries(paladin_events, response[0][1])
+
+                if asyncio.get_running_loop().time() - last_claim > self.claim_idle / 1000:
+                    # picks up entries from dead consumers, and our own entries that were dropped or failed
+                    await self._claim(paladin_events)
+                    last_claim = asyncio.get_running_loop().time()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+                await asyncio.sleep(5)
@@ -1,4 +1,6 @@
 import asyncio
+import collections
+import enum
 import inspect
 import traceback
 import typing
@@ -7,73 +9,355 @@ from source import utilities, shared
 
 log = utilities.getLog("events")
 
+_shutdown = object()
+"""Returned by the queue once it is closed and everything in it has been processed"""
+
+
+class StreamEntry:
+    """An action received from a durable event stream, it is acknowledged once dispatched"""
+
+    __slots__ = ("entry_id", "item")
+
+    def __init__(self, entry_id: bytes, item: shared.ActionRecord):
+        self.entry_id = entry_id
+        self.item = item
+
+
+class Priority(enum.IntEnum):
+    moderator = 0  # actions issued by a moderator
+    automatic = 1  # actions the bot made by itself, and internal events
+
+
+class OverflowPolicy(enum.Enum):
+    block = "block"  # wait for space
+    drop_oldest = "drop_oldest"  # drop the oldest item of the lowest priority
+    coalesce = "coalesce"  # like drop_oldest, but identical internal events (str) are only queued once
+
+
+class EventQueue:
+    """
+    A bounded queue with a lane per priority, higher priority lanes are always drained first
+
+    :param maxsize the most items held across all lanes
+    :type maxsize int
+
+    :param policy what to do when the queue is full
+    :type policy OverflowPolicy
+
+    :param on_drop called with each item dropped to make space
+    :type on_drop typing.Callable
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1000,
+        policy: OverflowPolicy = OverflowPolicy.drop_oldest,
+        on_drop: typing.Optional[typing.Callable[[typing.Any], None]] = None,
+    ):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.on_drop = on_drop
+
+        self._lanes: typing.Dict[Priority, collections.deque] = {p: collections.deque() for p in Priority}
+        self._changed = asyncio.Condition()
+        self._closed = False
+
+        # metrics
+        self.dropped: typing.Dict[Priority, int] = {p: 0 for p in Priority}
+        self.coalesced = 0
+        self.blocked = 0
+
+    def qsize(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def stats(self) -> dict:
+        """Queue depth and drop counters, for monitoring"""
+        return {
+            "depth": {p.name: len(lane) for p, lane in self._lanes.items()},
+            "dropped": {p.name: count for p, count in self.dropped.items()},
+            "coalesced": self.coalesced,
+            "blocked": self.blocked,
+        }
+
+    def _drop_oldest(self):
+        for priority in reversed(Priority):
+            if self._lanes[priority]:
+                item = self._lanes[priority].popleft()
+                self.dropped[priority] += 1
+                if self.dropped[priority] % 100 == 1:
+                    log.warning(f"Event queue full, {self.dropped[priority]} {priority.name} events dropped so far")
+                if self.on_drop is not None:
+                    self.on_drop(item)
+                return
+
+    async def put(self, item, priority: Priority = Priority.moderator, policy: typing.Optional[OverflowPolicy] = None):
+        """Add an item, `policy` overrides the queue's overflow policy for this item"""
+        policy = policy or self.policy
+        async with self._changed:
+            if self._closed:
+                return log.warning("Event queue is closed, dropping item")
+
+            if policy == OverflowPolicy.coalesce and isinstance(item, str) and item in self._lanes[priority]:
+                self.coalesced += 1
+                return
+
+            if self.qsize() >= self.maxsize:
+                if policy == OverflowPolicy.block:
+                    self.blocked += 1
+                    await self._changed.wait_for(lambda: self.qsize() < self.maxsize or self._closed)
+                else:
+                    self._drop_oldest()
+
+            self._lanes[priority].append(item)
+            self._changed.notify_all()
+
+    async def get(self):
+        """Get the next item, highest priority first. Returns `_shutdown` once closed and empty"""
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._closed or not self.empty())
+            for lane in self._lanes.values():
+                if lane:
+                    item = lane.popleft()
+                    self._changed.notify_all()
+                    return item
+            return _shutdown
+
+    async def close(self):
+        """Stop accepting items, get() will return `_shutdown` once everything queued has been taken"""
+        async with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+
 
 class Event(set):
     def __init__(self, name="DefaultName"):
         super(Event, self).__init__()
         self.name = name
 
-    async def trigger(self, *args, **kwargs):
-        for f in self:
-            log.debug(f"Calling {f.__name__}")
-            try:
-                if inspect.iscoroutinefunction(f):
+    async def trigger(self, *args, **kwargs) -> bool:
+        """Call all subscribers concurrently, returns False if any of them raised"""
+        results = await asyncio.gather(*[self._call(f, *args, **kwargs) for f in self])
+        return all(results)
 
-                    await f(*args, **kwargs)
-                else:
-                    await asyncio.to_thread(f, *args, **kwargs)
-            except Exception as e:
-                log.error(
-                    "Ignoring exception in {}: {}".format(
-                        f.__name__,
-                        "".join(traceback.format_exception(type(e), e, e.__traceback__)),
-                    )
+    @staticmethod
+    async def _call(f, *args, **kwargs) -> bool:
+        log.debug(f"Calling {f.__name__}")
+        try:
+            if inspect.iscoroutinefunction(f):
+                await f(*args, **kwargs)
+            else:
+                await asyncio.to_thread(f, *args, **kwargs)
+        except Exception as e:
+            log.error(
+                "Ignoring exception in {}: {}".format(
+                    f.__name__,
+                    "".join(traceback.format_exception(type(e), e, e.__traceback__)),
                 )
+            )
+            return False
+        return True
 
 
 class PaladinEvents:
-    def __init__(self):
-        self._queue = asyncio.Queue()
+    """
+    Queues paladin events and dispatches them to their subscribers
+
+    :param max_concurrency how many events may be dispatched at once
+    :type max_concurrency int
+
+    :param ordered_per_guild if set, events from the same guild are dispatched in the order they were queued
+    :type ordered_per_guild bool
+
+    :param maxsize the most events that may be queued
+    :type maxsize int
+
+    :param overflow_policy what to do with new events when the queue is full
+    :type overflow_policy OverflowPolicy
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        ordered_per_guild: bool = True,
+        maxsize: int = 1000,
+        overflow_policy: OverflowPolicy = OverflowPolicy.coalesce,
+    ):
+        self._queue = EventQueue(maxsize, overflow_policy, on_drop=self._dropped)
         self.process = False
 
+        self.ordered_per_guild = ordered_per_guild
+        self._slots = asyncio.Semaphore(max_concurrency)
+        # bounds events taken off the queue but not yet dispatched
+        self._held = asyncio.Semaphore(maxsize)
+        self._in_flight: typing.Set[asyncio.Task] = set()
+        # guild id -> events waiting for the guild's current event to be dispatched
+        # a guild only competes for a slot once its next event can run, so one busy guild can't fill every slot
+        self._waiting: typing.Dict[int, typing.Deque] = {}
+
         self.events = {
             "modAction": Event(name="modAction"),
         }
 
         self.task = None
 
+        self.stream = None
+        """An optional durable transport for actions, see eventStream.RedisEventStream"""
+
     def subscribe_to_event(self, function: typing.Callable, event="modAction"):
         """Subscribes to a mod action event"""
         if event not in self.events:
             self.events[event] = Event(name=event)
         self.events[event].add(function)
 
-    async def add_item(self, item: typing.Union[shared.Action, str]):
+    @staticmethod
+    def _priority(item: typing.Union[shared.ActionRecord, StreamEntry, str]) -> Priority:
+        """Actions made by moderators go ahead of anything the bot did itself"""
+        if isinstance(item, StreamEntry):
+            item = item.item
+        if isinstance(item, shared.ActionRecord):
+            if item.moderator_bot:
+                return Priority.automatic
+            if item.reason is not None and item.reason.startswith("AUTOMATIC ACTION"):
+                return Priority.automatic
+            return Priority.moderator
+        return Priority.automatic
+
+    def stats(self) -> dict:
+        """Queue depth and drop counters, for monitoring"""
+        stats = self._queue.stats()
+        stats["in_flight"] = len(self._in_flight)
+        return stats
+
+    async def add_item(
+        self, item: typing.Union[shared.Action, StreamEntry, str], priority: typing.Optional[Priority] = None
+    ):
         """Add item to queue"""
+        if isinstance(item, shared.Action):
+            # only a snapshot is queued, so the queue doesn't keep discord objects alive
+            item = item.to_record()
+
+        if self.stream is not None and isinstance(item, shared.ActionRecord):
+            # the stream's consumers will queue it
+            return await self.stream.publish(item)
+
         log.debug("Adding item to queue")
-        await self._queue.put(item)
+        # stream entries wait for space, which holds back the stream's consumer instead of losing entries
+        policy = OverflowPolicy.block if isinstance(item, StreamEntry) else None
+        await self._queue.put(item, priority if priority is not None else self._priority(item), policy)
 
         # if event loop isn't running, start it
-        if self.task is None or self.task.done():
+        if self.process and (self.task is None or self.task.done()):
             self.task = asyncio.create_task(self.event_loop())
 
-    async def get_item(self) -> typing.Union[shared.Action, str]:
+    def _dropped(self, item):
+        if isinstance(item, StreamEntry) and self.stream is not None:
+            # left pending, so it is claimed and queued again once idle
+            self.stream.release(item.entry_id)
+
+    async def get_item(self) -> typing.Union[shared.ActionRecord, StreamEntry, str]:
         """Get item from queue"""
         item = await self._queue.get()
         return item
 
     async def event_loop(self):
         """The event loop for paladin events
-        Checks for pending events, calls their corresponding event system,"""
-        while self.process:
-            await asyncio.sleep(0)
-            if not self._queue.empty():
-                item = await self.get_item()
-
-                # handle both Action objects, and str
-                if isinstance(item, shared.Action):
-                    if item.event_type in self.events:
-                        await self.events[item.event_type].trigger(item)
-                if isinstance(item, str):
-                    if item in self.events:
-                        await self.events[item].trigger()
+        Waits for pending events, calls their corresponding event system, until shutdown"""
+        while True:
+            item = await self.get_item()
+            if item is _shutdown:
+                if self._in_flight:
+                    await asyncio.wait(self._in_flight)
+                return
+
+            await self._held.acquire()
+
+            action = item.item if isinstance(item, StreamEntry) else item
+            guild_id = None
+            if self.ordered_per_guild and isinstance(action, shared.ActionRecord):
+                guild_id = action.guild_id
+
+            if guild_id is not None:
+                if guild_id in self._waiting:
+                    self._waiting[guild_id].append(item)
+                    continue
+                self._waiting[guild_id] = collections.deque()
+
+            task = asyncio.create_task(self._run_guild(item, guild_id))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _run_guild(
+        self, item: typing.Union[shared.ActionRecord, StreamEntry, str], guild_id: typing.Optional[int]
+    ):
+        """Dispatches an event, then any events from its guild that queued up behind it, in order"""
+        while True:
+            try:
+                # the slot is given up between events, so other guilds get a turn
+                async with self._slots:
+                    await self._dispatch(item)
+            except asyncio.CancelledError:
+                # drop the guild's backlog, otherwise its later events would wait behind a task that is gone
+                for _ in self._waiting.pop(guild_id, ()):
+                    self._held.release()
+                raise
+            except Exception as e:
+                log.error("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+            finally:
+                self._held.release()
+
+            if guild_id is None:
+                return
+            waiting = self._waiting[guild_id]
+            if not waiting:
+                del self._waiting[guild_id]
+                return
+            item = waiting.popleft()
+
+    async def _dispatch(self, item: typing.Union[shared.ActionRecord, StreamEntry, str]):
+        """Calls the event system for an item
+        Stream entries are only acknowledged if every subscriber succeeded, otherwise they are retried once idle"""
+        entry = None
+        if isinstance(item, StreamEntry):
+            entry, item = item, item.item
+
+        success = False
+        try:
+            # handle both actions, and str
+            if isinstance(item, shared.ActionRecord):
+                if item.event_type in self.events:
+                    success = await self.events[item.event_type].trigger(item)
+                else:
+                    success = True
+            if isinstance(item, str):
+                if item in self.events:
+                    success = await self.events[item].trigger()
+                else:
+                    success = True
+        finally:
+            if entry is not None:
+                if success:
+                    await self.stream.ack(entry.entry_id)
+                else:
+                    log.warning(f"Not acknowledging entry {entry.entry_id}, it will be retried")
+                    self.stream.release(entry.entry_id)
+
+    async def shutdown(self, timeout: float = 10):
+        """Process everything already queued, then stop the event loop
+        Anything still pending after `timeout` seconds is dropped"""
+        self.process = False
+        if self.stream is not None:
+            self.stream.stop()
+        if self.task is None or self.task.done():
+            return
+
+        await self._queue.close()
+        try:
+            await asyncio.wait_for(asyncio.shield(self.task), timeout=timeout)
+        except asyncio.TimeoutError:
+            log.warning(f"Event queue didn't drain within {timeout}s, dropping {self._queue.qsize()} items")
+            self.task.cancel()
+            for task in self._in_flight:
+                task.cancel()
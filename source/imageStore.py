@@ -0,0 +1,279 @@
+import asyncio
+import hashlib
+import os
+import time
+import typing
+import uuid
+
+from source import utilities
+
+log = utilities.getLog("imageStore")
+
+# take a reference to an image, unless it is being deleted
+take_ref_script = """
+if redis.call("EXISTS", KEYS[2]) == 1 then
+    return 0
+end
+return redis.call("HINCRBY", KEYS[1], ARGV[1], 1)
+"""
+
+# drop a reference to an image, if it was the last, mark the image as being deleted until its file is removed
+drop_ref_script = """
+if redis.call("HINCRBY", KEYS[1], ARGV[1], -1) > 0 then
+    return 0
+end
+redis.call("HDEL", KEYS[1], ARGV[1])
+redis.call("SET", KEYS[2], 1, "EX", ARGV[2])
+return 1
+"""
+
+
+class StoredImage(typing.NamedTuple):
+    attachment_id: int
+    digest: str
+    extension: str
+    path: str
+
+
+class ImageStore:
+    """
+    A content-addressed store for attachment images
+
+    Images are stored once per unique content, named by their sha256 under two levels of sharded directories
+    (`{root}/ab/cd/abcd....png`), so reposts don't take up more space and no directory grows too large.
+
+    Images are kept for `ttl` seconds, and the least recently used are evicted early when a guild, or the store
+    as a whole, goes over its quota. Each message is charged for its images, even when they're shared.
+
+    Redis keys:
+        `image||{message_id}` a hash of attachment id to "{digest}.{extension}", plus the `_guild` and `_size`
+        `image_refs` a hash of "{digest}.{extension}" to how many attachments use that image
+        `image_deleting||{digest}.{extension}` set while an image's file is being removed
+        `image_usage` a hash of guild id (and "global") to bytes stored
+        `image_lru` a zset of "{guild_id}|{message_id}" by when its images were last used
+        `image_lru||{guild_id}` the same, for one guild
+
+    :param redis the bots redis client
+    :param root the directory images are stored in
+    :param ttl how long, in seconds, images are kept
+    :param guild_quota the most bytes of images kept for one guild
+    :param global_quota the most bytes of images kept overall
+    """
+
+    def __init__(
+        self,
+        redis,
+        root: str = "data/images",
+        ttl: float = 14 * 24 * 60 * 60,
+        guild_quota: int = 256 * 1024 * 1024,
+        global_quota: int = 10 * 1024 * 1024 * 1024,
+    ):
+        self.redis = redis
+        self.root = root
+        self.ttl = ttl
+        self.guild_quota = guild_quota
+        self.global_quota = global_quota
+
+    @staticmethod
+    def _index_key(message_id: int) -> str:
+        return f"image||{message_id}"
+
+    @staticmethod
+    def _deleting_key(blob: str) -> str:
+        return f"image_deleting||{blob}"
+
+    def path(self, digest: str, extension: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{digest}.{extension}")
+
+    @staticmethod
+    def _write(path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first, so a reader never sees half an image
+        # the name is unique, as the same image may be written by two puts at once
+        temp = f"{path}.{uuid.uuid4().hex}.TEMP"
+        try:
+            with open(temp, "wb") as f:
+                f.write(data)
+            os.replace(temp, path)
+        except BaseException:
+            try:
+                os.remove(temp)
+            except FileNotFoundError:
+                pass
+            raise
+
+    async def put(
+        self,
+        guild_id: int,
+        message_id: int,
+        attachment_id: int,
+        data: bytes,
+        extension: str,
+        transform: typing.Optional[typing.Callable[[bytes], typing.Awaitable[bytes]]] = None,
+    ) -> typing.Tuple[StoredImage, bool]:
+        """Store an attachment, returns the image and if it is new to the store
+
+        :param extension the extension the image is saved with, after `transform`
+        :param transform applied to images new to the store before they're written, ie. compression
+        """
+        extension = extension.lower()
+        # images are addressed by their original content, so reposts are found without transforming them again
+        digest = hashlib.sha256(data).hexdigest()
+        blob = f"{digest}.{extension}"
+        path = self.path(digest, extension)
+
+        while True:
+            refs = await self.redis.eval(take_ref_script, 2, "image_refs", self._deleting_key(blob), blob)
+            if refs:
+                break
+            # the last reference was just released, wait for the file to be removed before storing it again
+            await asyncio.sleep(0.05)
+        # with a reference held the file can't be removed, so this is accurate
+        created = refs == 1 or not await asyncio.to_thread(os.path.exists, path)
+        if created:
+            try:
+                if transform is not None:
+                    data = await transform(data)
+                await asyncio.to_thread(self._write, path, data)
+            except BaseException:
+                await self.redis.hincrby("image_refs", blob, -1)
+                raise
+            size = len(data)
+        else:
+            try:
+                size = await asyncio.to_thread(os.path.getsize, path)
+            except FileNotFoundError:
+                size = len(data)
+
+        now = time.time()
+        async with await self.redis.pipeline() as pipe:
+            pipe.hset(self._index_key(message_id), mapping={attachment_id: blob, "_guild": guild_id})
+            pipe.hincrby(self._index_key(message_id), "_size", size)
+            pipe.hincrby("image_usage", guild_id, size)
+            pipe.hincrby("image_usage", "global", size)
+            pipe.zadd("image_lru", {f"{guild_id}|{message_id}": now})
+            pipe.zadd(f"image_lru||{guild_id}", {message_id: now})
+            await pipe.execute()
+        return StoredImage(attachment_id, digest, extension, path), created
+
+    async def get(self, message_id: int) -> typing.List[StoredImage]:
+        """Get the stored images of a message"""
+        raw_data = await self.redis.hgetall(self._index_key(message_id))
+        images = []
+        for attachment_id, blob in raw_data.items():
+            if attachment_id.startswith(b"_"):
+                continue
+            digest, extension = blob.decode().split(".", 1)
+            images.append(StoredImage(int(attachment_id), digest, extension, self.path(digest, extension)))
+
+        if images:
+            guild_id = int(raw_data[b"_guild"])
+            now = time.time()
+            async with await self.redis.pipeline(transaction=False) as pipe:
+                pipe.zadd("image_lru", {f"{guild_id}|{message_id}": now}, xx=True)
+                pipe.zadd(f"image_lru||{guild_id}", {message_id: now}, xx=True)
+                await pipe.execute()
+        return images
+
+    async def release(self, message_id: int, guild_id: typing.Optional[int] = None) -> int:
+        """Forget a message's images, deleting any that are no longer used, returns the bytes freed"""
+        key = self._index_key(message_id)
+        async with await self.redis.pipeline() as pipe:
+            pipe.hgetall(key)
+            pipe.delete(key)
+            raw_data, deleted = await pipe.execute()
+
+        if raw_data and deleted:
+            guild_id = int(raw_data[b"_guild"])
+        size = int(raw_data.get(b"_size", 0)) if deleted else 0
+
+        if guild_id is not None:
+            async with await self.redis.pipeline() as pipe:
+                pipe.zrem("image_lru", f"{guild_id}|{message_id}")
+                pipe.zrem(f"image_lru||{guild_id}", message_id)
+                if size:
+                    pipe.hincrby("image_usage", guild_id, -size)
+                    pipe.hincrby("image_usage", "global", -size)
+                await pipe.execute()
+
+        if not deleted:
+            # already released
+            return 0
+
+        for field, blob in raw_data.items():
+            if field.startswith(b"_"):
+                continue
+            blob = blob.decode()
+            deleting_key = self._deleting_key(blob)
+            if await self.redis.eval(drop_ref_script, 2, "image_refs", deleting_key, blob, 60):
+                digest, extension = blob.split(".", 1)
+                try:
+                    await asyncio.to_thread(os.remove, self.path(digest, extension))
+                except FileNotFoundError:
+                    pass
+                finally:
+                    await self.redis.delete(deleting_key)
+        return size
+
+    async def _release_member(self, member: bytes) -> int:
+        guild_id, message_id = member.decode().split("|")
+        return await self.release(int(message_id), guild_id=int(guild_id))
+
+    async def sweep(self, batch: int = 200) -> int:
+        """Release expired images, then the least recently used of anything over quota
+
+        At most `batch` messages are released per call, so the sweep can be run often without blocking anything
+        :returns the number of messages released
+        """
+        released = 0
+
+        expired = await self.redis.zrangebyscore("image_lru", "-inf", time.time() - self.ttl, start=0, num=batch)
+        for member in expired:
+            await self._release_member(member)
+            released += 1
+
+        usage = {key.decode(): int(value) for key, value in (await self.redis.hgetall("image_usage")).items()}
+
+        over = usage.get("global", 0) - self.global_quota
+        if over > 0 and released < batch:
+            for member in await self.redis.zrangebyscore("image_lru", "-inf", "+inf", start=0, num=batch - released):
+                over -= await self._release_member(member)
+                released += 1
+                if over <= 0:
+                    break
+
+        for guild_id, used in usage.items():
+            over = used - self.guild_quota
+            if guild_id == "global" or over <= 0 or released >= batch:
+                continue
+            oldest = await self.redis.zrangebyscore(
+                f"image_lru||{guild_id}", "-inf", "+inf", start=0, num=batch - released
+            )
+            for message_id in oldest:
+                over -= await self.release(int(message_id), guild_id=int(guild_id))
+                released += 1
+                if over <= 0:
+                    break
+
+        released += await asyncio.to_thread(self._remove_legacy, batch - released)
+        if released:
+            log.debug(f"Swept {released} stored messages")
+        return released
+
+    def _remove_legacy(self, limit: int) -> int:
+        """Remove images saved before the store was content-addressed, they can't be found anymore"""
+        if limit <= 0 or not os.path.isdir(self.root):
+            return 0
+        removed = 0
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                # legacy images were named {guild}_{message}_{attachment}.{extension}, shards are directories
+                if entry.name.count("_") == 2 and entry.is_file():
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        continue
+                    removed += 1
+                    if removed >= limit:
+                        break
+        return removed
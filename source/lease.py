@@ -0,0 +1,105 @@
+import asyncio
+import traceback
+import typing
+import uuid
+
+from source import utilities
+
+log = utilities.getLog("lease")
+
+# only touch the lease if we still own it
+renew_script = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+release_script = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+class RedisLease:
+    """A lease held in redis, used to elect a single leader between processes
+
+    The holder renews the lease every third of its ttl, if it stops (or can't reach redis) another process
+    takes over within `ttl` plus one renewal interval.
+
+    :param redis the bots redis client
+    :param key the key the lease is stored under
+    :param ttl how long, in seconds, the lease lasts without renewal
+    :param on_acquire called when this process becomes the leader
+    :param on_release called when this process stops being the leader
+    """
+
+    def __init__(
+        self,
+        redis,
+        key: str,
+        ttl: float = 15,
+        on_acquire: typing.Optional[typing.Callable[[], typing.Awaitable]] = None,
+        on_release: typing.Optional[typing.Callable[[], typing.Awaitable]] = None,
+    ):
+        self.redis = redis
+        self.key = key
+        self.ttl = ttl
+        self.on_acquire = on_acquire
+        self.on_release = on_release
+
+        self.token = uuid.uuid4().hex
+        """Identifies this process as the holder"""
+
+        self.held = False
+        """Does this process currently hold the lease"""
+
+        self._task: typing.Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop renewing, and hand the lease over straight away if we hold it"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.held:
+            try:
+                await self.redis.eval(release_script, 1, self.key, self.token)
+            finally:
+                await self._set_held(False)
+
+    async def _set_held(self, held: bool):
+        if held == self.held:
+            return
+        self.held = held
+        log.info(f"{'Acquired' if held else 'Lost'} lease {self.key}")
+
+        callback = self.on_acquire if held else self.on_release
+        if callback is not None:
+            try:
+                await callback()
+            except Exception as e:
+                log.error("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+
+    async def _run(self):
+        px = int(self.ttl * 1000)
+        while True:
+            try:
+                if self.held:
+                    held = bool(await self.redis.eval(renew_script, 1, self.key, self.token, px))
+                else:
+                    held = bool(await self.redis.set(self.key, self.token, px=px, nx=True))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # we can't prove we still hold it, so assume we don't
+                log.warning(f"Unable to renew lease {self.key}: {e}")
+                held = False
+
+            await self._set_held(held)
+            await asyncio.sleep(self.ttl / 3)
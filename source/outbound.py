@@ -0,0 +1,250 @@
+import asyncio
+import collections
+import enum
+import re
+import time
+import traceback
+import typing
+
+import aiohttp
+
+from source import utilities
+
+log = utilities.getLog("outbound")
+
+_api_prefix = re.compile(r"^/api/v\d+")
+_major_resources = {"channels", "guilds", "webhooks"}
+
+
+class Priority(enum.IntEnum):
+    interactive = 0  # responses to something a user is doing, ie. paginator edits
+    moderation = 1  # the action log
+    log = 2  # the moderation log, and anything else that can wait
+
+
+def route_key(method: str, path: str) -> str:
+    """Reduce a request to the route discord rate limits it by
+
+    The major parameter (the channel, guild or webhook id) is kept, other ids, webhook tokens and emoji are not
+    """
+    parts = _api_prefix.sub("", path).strip("/").split("/")
+    route = []
+    for i, part in enumerate(parts):
+        if i == 1 and parts[0] in _major_resources:
+            route.append(part)
+        elif i == 2 and parts[0] == "webhooks":
+            route.append(":token")
+        elif i > 0 and parts[i - 1] == "reactions":
+            route.append(":emoji")
+        elif part.isdigit():
+            route.append(":id")
+        else:
+            route.append(part)
+    return f"{method.upper()} /{'/'.join(route)}"
+
+
+class RouteBucket:
+    """What we know about a route's rate limit, learnt from discord's headers"""
+
+    __slots__ = ("remaining", "reset_at")
+
+    def __init__(self):
+        self.remaining: typing.Optional[int] = None
+        self.reset_at = 0.0
+
+    def wait_time(self, now: float) -> float:
+        """How long until a request can be made on this route"""
+        if self.remaining is None or self.remaining > 0 or now >= self.reset_at:
+            return 0
+        return self.reset_at - now
+
+    def take(self, now: float):
+        if now >= self.reset_at:
+            # the window has reset, we don't know how many requests we have until discord tells us
+            self.remaining = None
+        elif self.remaining is not None:
+            self.remaining -= 1
+
+
+class _Request:
+    __slots__ = ("route", "call", "future")
+
+    def __init__(self, route: str, call: typing.Callable[[], typing.Awaitable]):
+        self.route = route
+        self.call = call
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class OutboundScheduler:
+    """
+    Coordinates requests to discord that would otherwise fight over the same rate limits
+
+    Requests are queued by priority, and within a priority each guild takes its turn, so one busy guild can't
+    starve the others. A request is only started once its route has requests left, which is learnt from the
+    headers of every response made through the session passed to `attach`.
+
+    :param max_concurrency the most requests in flight at once
+    """
+
+    def __init__(self, max_concurrency: int = 10):
+        self.max_concurrency = max_concurrency
+
+        # priority -> guild id -> pending requests, guilds are rotated to the back once served
+        self._queues: typing.Dict[Priority, "collections.OrderedDict[typing.Any, collections.deque]"] = {
+            p: collections.OrderedDict() for p in Priority
+        }
+        self._buckets: typing.Dict[str, RouteBucket] = collections.defaultdict(RouteBucket)
+        self._global_reset_at = 0.0
+
+        self._changed: typing.Optional[asyncio.Event] = None
+        self._slots: typing.Optional[asyncio.Semaphore] = None
+        self._task: typing.Optional[asyncio.Task] = None
+        self._in_flight: typing.Set[asyncio.Task] = set()
+
+    def __len__(self):
+        return sum(len(q) for queues in self._queues.values() for q in queues.values())
+
+    def attach(self, session: aiohttp.ClientSession):
+        """Learn rate limits from the responses of an aiohttp session, ie. the one discord.py uses
+
+        discord.py builds its session without trace configs, so ours is added to the session afterwards.
+        aiohttp (3.7, as pinned) reads `_trace_configs` for each request, so the list can be extended once the
+        session exists. If a newer aiohttp stops keeping it, rate limits just aren't learnt
+        """
+        if not isinstance(getattr(session, "_trace_configs", None), list):
+            log.warning("Unable to trace the session, rate limits won't be learnt from responses")
+            return
+        trace = aiohttp.TraceConfig()
+        trace.on_request_end.append(self._on_request_end)
+        trace.freeze()
+        session._trace_configs.append(trace)
+
+    async def _on_request_end(self, session, ctx, params: aiohttp.TraceRequestEndParams):
+        try:
+            self.update(params.method, params.url.path, params.response.status, params.response.headers)
+        except Exception as e:
+            log.error("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+
+    def update(self, method: str, path: str, status: int, headers: typing.Mapping):
+        """Update a route's bucket from a response"""
+        now = time.monotonic()
+        if status == 429 and headers.get("X-RateLimit-Global"):
+            self._global_reset_at = now + float(headers.get("Retry-After", 1))
+            log.warning(f"Hit the global rate limit, pausing for {self._global_reset_at - now:.2f}s")
+            return
+
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_after = headers.get("X-RateLimit-Reset-After")
+        if remaining is None or reset_after is None:
+            return
+
+        bucket = self._buckets[route_key(method, path)]
+        bucket.remaining = int(remaining)
+        bucket.reset_at = now + float(reset_after)
+        if self._changed is not None:
+            self._changed.set()
+
+    async def send(
+        self,
+        method: str,
+        path: str,
+        call: typing.Callable[[], typing.Awaitable],
+        guild_id: typing.Optional[int] = None,
+        priority: Priority = Priority.log,
+    ):
+        """Queue a request, and wait for its result
+
+        :param method the http method of the request
+        :param path the path of the request, ie. f"/channels/{channel.id}/messages"
+        :param call makes the request, ie. `functools.partial(channel.send, embed=embed)`
+        :param guild_id the guild the request is for
+        :param priority how urgent the request is
+        """
+        self._start()
+        request = _Request(route_key(method, path), call)
+        self._queues[priority].setdefault(guild_id, collections.deque()).append(request)
+        self._changed.set()
+        return await request.future
+
+    def _start(self):
+        if self._task is None or self._task.done():
+            self._changed = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._task = asyncio.create_task(self._run())
+
+    def _next(self) -> typing.Tuple[typing.Optional[_Request], typing.Optional[float]]:
+        """Pick the next request that can be made, or how long until one can be"""
+        now = time.monotonic()
+        if now < self._global_reset_at:
+            return None, self._global_reset_at - now
+
+        shortest_wait = None
+        for priority in Priority:
+            queues = self._queues[priority]
+            for guild_id in list(queues):
+                queue = queues[guild_id]
+                while queue and queue[0].future.done():
+                    # the caller gave up waiting
+                    queue.popleft()
+                if not queue:
+                    del queues[guild_id]
+                    continue
+
+                request = queue[0]
+                wait = self._buckets[request.route].wait_time(now)
+                if wait > 0:
+                    shortest_wait = wait if shortest_wait is None else min(shortest_wait, wait)
+                    continue
+
+                queue.popleft()
+                del queues[guild_id]
+                if queue:
+                    # back of the line
+                    queues[guild_id] = queue
+                self._buckets[request.route].take(now)
+                return request, None
+        return None, shortest_wait
+
+    async def _run(self):
+        while True:
+            self._changed.clear()
+            request, wait = self._next()
+            if request is None:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._slots.acquire()
+            task = asyncio.create_task(self._make(request))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _make(self, request: _Request):
+        try:
+            result = await request.call()
+        except asyncio.CancelledError:
+            request.future.cancel()
+            raise
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+        else:
+            if not request.future.done():
+                request.future.set_result(result)
+        finally:
+            self._slots.release()
+
+    async def close(self):
+        """Stop making requests, anything still queued is cancelled"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for queues in self._queues.values():
+            for queue in queues.values():
+                for request in queue:
+                    request.future.cancel()
+            queues.clear()
+        if self._in_flight:
+            await asyncio.wait(self._in_flight, timeout=5)
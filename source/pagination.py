@@ -3,6 +3,7 @@ https://github.com/python-discord/bot/blob/master/bot/pagination.py
 """
 
 import asyncio
+import functools
 import logging
 import typing
 import typing as t
@@ -23,6 +24,28 @@ PAGINATION_EMOJI = (FIRST_EMOJI, LEFT_EMOJI, RIGHT_EMOJI, LAST_EMOJI)
 log = logging.getLogger(__name__)
 
 
+async def _interactive(ctx, method: str, path: str, call: t.Callable[[], t.Awaitable]):
+    """Make a request through the bot's outbound scheduler, if it has one"""
+    # imported here, as outbound imports utilities, which imports this module
+    from source.outbound import Priority
+
+    scheduler = getattr(ctx.bot, "outbound", None)
+    if scheduler is None:
+        return await call()
+    guild_id = ctx.guild.id if ctx.guild else None
+    return await scheduler.send(method, path, call, guild_id=guild_id, priority=Priority.interactive)
+
+
+async def _edit_page(ctx, message: discord.Message, embed: discord.Embed):
+    """Show a new page"""
+    await _interactive(
+        ctx,
+        "PATCH",
+        f"/channels/{message.channel.id}/messages/{message.id}",
+        functools.partial(message.edit, embed=embed),
+    )
+
+
 class EmptyPaginatorEmbed(Exception):
     """Raised when attempting to paginate with empty contents."""
 
@@ -309,7 +332,12 @@ class LinePaginator(Paginator):
         for emoji in PAGINATION_EMOJI:
             # Add all the applicable emoji to the message
             log.debug(f"Adding reaction: {repr(emoji)}")
-            await message.add_reaction(emoji)
+            await _interactive(
+                ctx,
+                "PUT",
+                f"/channels/{message.channel.id}/messages/{message.id}/reactions/{emoji}/@me",
+                functools.partial(message.add_reaction, emoji),
+            )
 
         while True:
             try:
@@ -330,7 +358,7 @@ class LinePaginator(Paginator):
                     embed.set_footer(text=f"{footer_text} (Page {current_page + 1}/{len(paginator.pages)})")
                 else:
                     embed.set_footer(text=f"Page {current_page + 1}/{len(paginator.pages)}")
-                await message.edit(embed=embed)
+                await _edit_page(ctx, message, embed)
 
             if reaction.emoji == LAST_EMOJI:
                 await message.remove_reaction(reaction.emoji, user)
@@ -343,7 +371,7 @@ class LinePaginator(Paginator):
                     embed.set_footer(text=f"{footer_text} (Page {current_page + 1}/{len(paginator.pages)})")
                 else:
                     embed.set_footer(text=f"Page {current_page + 1}/{len(paginator.pages)}")
-                await message.edit(embed=embed)
+                await _edit_page(ctx, message, embed)
 
             if reaction.emoji == LEFT_EMOJI:
                 await message.remove_reaction(reaction.emoji, user)
@@ -362,7 +390,7 @@ class LinePaginator(Paginator):
                 else:
                     embed.set_footer(text=f"Page {current_page + 1}/{len(paginator.pages)}")
 
-                await message.edit(embed=embed)
+                await _edit_page(ctx, message, embed)
 
             if reaction.emoji == RIGHT_EMOJI:
                 await message.remove_reaction(reaction.emoji, user)
@@ -381,7 +409,7 @@ class LinePaginator(Paginator):
                 else:
                     embed.set_footer(text=f"Page {current_page + 1}/{len(paginator.pages)}")
 
-                await message.edit(embed=embed)
+                await _edit_page(ctx, message, embed)
 
         log.debug("Ending pagination and clearing reactions.")
         with suppress(discord.NotFound):
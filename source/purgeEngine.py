@@ -0,0 +1,332 @@
+import asyncio
+import enum
+import functools
+import re
+import traceback
+import typing
+
+import discord
+import regex
+
+from source import outbound, snowflake, utilities
+
+log = utilities.getLog("purgeEngine")
+
+bulk_delete_age = 14 * 24 * 60 * 60 - 5 * 60
+"""Discord only bulk deletes messages younger than 14 days, leave some slack for the time spent scanning"""
+
+_link = re.compile(r"https?://\S+", re.IGNORECASE)
+
+
+class Content(enum.IntEnum):
+    attachments = 1  # messages with attachments
+    links = 2  # messages with links
+    either = 3  # messages with attachments or links
+
+
+class PatternTimeout(Exception):
+    """The pattern took too long to match a message"""
+
+
+class PurgeFilter:
+    """
+    Which messages a purge deletes, every condition that is set has to match
+
+    :param authors only messages from these user ids
+    :param pattern only messages whose content matches this regex, compiled with the `regex` module
+    :param content only messages with attachments and/or links
+    :param after only messages after this snowflake
+    :param before only messages before this snowflake, defaults to now
+    :param match_timeout how long, in seconds, the pattern may take on one message
+    """
+
+    def __init__(
+        self,
+        authors: typing.Optional[typing.Set[int]] = None,
+        pattern: typing.Optional[regex.Pattern] = None,
+        content: typing.Optional[Content] = None,
+        after: int = 0,
+        before: typing.Optional[int] = None,
+        match_timeout: float = 0.05,
+    ):
+        self.authors = authors or set()
+        self.pattern = pattern
+        self.content = content
+        self.after = after
+        self.before = before or snowflake.ago(0)
+        self.match_timeout = match_timeout
+
+    @property
+    def by_id(self) -> bool:
+        """Can this filter be answered from message ids alone"""
+        return not self.authors and self.pattern is None and self.content is None
+
+    def __call__(self, message: discord.Message) -> bool:
+        if self.authors and message.author.id not in self.authors:
+            return False
+        if self.pattern is not None:
+            # patterns come from users, a backtracking pattern would otherwise block the event loop
+            try:
+                if not self.pattern.search(message.content, timeout=self.match_timeout):
+                    return False
+            except TimeoutError:
+                raise PatternTimeout()
+        if self.content is not None:
+            has_attachments = bool(message.attachments) and self.content & Content.attachments
+            has_links = self.content & Content.links and _link.search(message.content) is not None
+            if not (has_attachments or has_links):
+                return False
+        return True
+
+    def describe(self) -> typing.List[str]:
+        """A line for each condition, for embeds"""
+        lines = []
+        if self.authors:
+            lines.append(f"From {', '.join(f'<@{a}>' for a in self.authors)}")
+        if self.pattern is not None:
+            lines.append(f"Matching `{self.pattern.pattern}`")
+        if self.content is not None:
+            lines.append(f"With {self.content.name if self.content != Content.either else 'attachments or links'}")
+        if self.after:
+            lines.append(f"Sent after {snowflake.to_datetime(self.after).strftime('%Y-%m-%d %H:%M')} UTC")
+        return lines
+
+
+class PurgeProgress:
+    """How far along a purge is"""
+
+    def __init__(self, channels: typing.Iterable[int]):
+        self.scanned = 0
+        self.failed = 0
+        self.done = False
+        """Have the bulk deletes finished, older messages may still be being deleted"""
+
+        self.old_done = False
+        """Have the older messages finished deleting"""
+
+        self.error: typing.Optional[str] = None
+        """Why the purge stopped early"""
+
+        self.deleted: typing.Dict[int, int] = {c: 0 for c in channels}
+        """Channel id -> messages deleted"""
+
+        self.old_queued = 0
+        self.old_deleted = 0
+
+    @property
+    def total(self) -> int:
+        return sum(self.deleted.values())
+
+
+class PurgeEngine:
+    """
+    Purges several channels at once
+
+    Each channel is scanned newest first, and matching messages are bulk deleted in chunks of 100 as soon as a
+    chunk fills, so deleting overlaps with scanning. Messages too old to bulk delete are handed to a background
+    lane per channel that deletes them one at a time, at a lower priority. `run` returns once the bulk deletes
+    are done, `finish_old` waits for the background lanes. Every delete goes through the bots outbound scheduler,
+    which keeps us within rate limits.
+
+    When the filter only needs message ids and the bots message index covers the window, channels aren't scanned
+
+    :param bot the bot
+    :param channels the channels to purge
+    :param check which messages to delete
+    :param limit the most messages deleted from each channel
+    :param old delete messages older than 14 days too
+    :param max_scan the most messages scanned in each channel
+    :param on_progress called with the progress every `progress_interval` seconds while it changes, and at the end
+    """
+
+    def __init__(
+        self,
+        bot,
+        channels: typing.List[discord.TextChannel],
+        check: PurgeFilter,
+        limit: int,
+        old: bool = False,
+        max_scan: int = 10_000,
+        on_progress: typing.Optional[typing.Callable[[PurgeProgress], typing.Awaitable]] = None,
+        progress_interval: float = 2,
+    ):
+        self.bot = bot
+        self.channels = channels
+        self.check = check
+        self.limit = limit
+        self.old = old
+        self.max_scan = max_scan
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+
+        self.progress = PurgeProgress(c.id for c in channels)
+        self._changed = asyncio.Event()
+        self._reporter_task: typing.Optional[asyncio.Task] = None
+        self._old_lanes: typing.List[asyncio.Task] = []
+
+    async def run(self) -> PurgeProgress:
+        """Scan and bulk delete every channel, messages older than 14 days carry on deleting in the background"""
+        if self.on_progress:
+            self._reporter_task = asyncio.create_task(self._reporter())
+        try:
+            await asyncio.gather(*[self._purge_channel(channel) for channel in self.channels])
+        except BaseException:
+            self.cancel()
+            raise
+        finally:
+            self.progress.done = True
+
+        if not self._old_lanes:
+            self._stop_reporter()
+            self.progress.old_done = True
+        if self.on_progress:
+            await self._report()
+        return self.progress
+
+    async def finish_old(self) -> PurgeProgress:
+        """Wait for the older messages to be deleted"""
+        try:
+            await asyncio.gather(*self._old_lanes)
+        finally:
+            self._stop_reporter()
+            self.progress.old_done = True
+        if self.on_progress:
+            await self._report()
+        return self.progress
+
+    def cancel(self):
+        for task in self._old_lanes:
+            task.cancel()
+        self._stop_reporter()
+
+    def _stop_reporter(self):
+        if self._reporter_task is not None:
+            self._reporter_task.cancel()
+            self._reporter_task = None
+
+    async def _report(self):
+        try:
+            await self.on_progress(self.progress)
+        except Exception as e:
+            log.error("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+
+    async def _reporter(self):
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            await self._report()
+            await asyncio.sleep(self.progress_interval)
+
+    async def _purge_channel(self, channel: discord.TextChannel):
+        if self.limit < 1:
+            return
+        cutoff = snowflake.ago(bulk_delete_age)
+        after = self.check.after if self.old else max(self.check.after, cutoff)
+        index = self.bot.recent_messages
+
+        if self.check.by_id and after >= cutoff and index.covers(channel.id, after):
+            message_ids = index[channel.id].range(after=after, before=self.check.before)
+            message_ids = message_ids[max(len(message_ids) - self.limit, 0) :]
+            chunks = [list(message_ids[i : i + 100]) for i in range(0, len(message_ids), 100)]
+            await asyncio.gather(*[self._bulk_delete(channel, chunk) for chunk in chunks])
+            return
+
+        bulk = []
+        chunk = []
+        old_queue: typing.Optional[asyncio.Queue] = None
+        old_lane: typing.Optional[asyncio.Task] = None
+        matched = 0
+        try:
+            async for message in channel.history(
+                limit=self.max_scan,
+                before=discord.Object(id=self.check.before),
+                after=discord.Object(id=after) if after else None,
+                oldest_first=False,
+            ):
+                if self.progress.error is not None:
+                    # another channel hit a problem
+                    break
+                self.progress.scanned += 1
+                if not self.check(message):
+                    continue
+                matched += 1
+
+                if message.id >= cutoff:
+                    chunk.append(message.id)
+                    if len(chunk) == 100:
+                        bulk.append(asyncio.create_task(self._bulk_delete(channel, chunk)))
+                        chunk = []
+                else:
+                    if old_lane is None:
+                        old_queue = asyncio.Queue()
+                        old_lane = asyncio.create_task(self._old_lane(channel, old_queue))
+                    old_queue.put_nowait(message.id)
+                    self.progress.old_queued += 1
+
+                if matched >= self.limit:
+                    break
+            self._changed.set()
+
+            if chunk:
+                bulk.append(asyncio.create_task(self._bulk_delete(channel, chunk)))
+            await asyncio.gather(*bulk)
+        except PatternTimeout:
+            self.progress.error = "The pattern took too long to match a message, try a simpler pattern"
+            # whatever was matched already is still deleted
+            if chunk:
+                await self._bulk_delete(channel, chunk)
+            await asyncio.gather(*bulk)
+        except discord.Forbidden:
+            log.warning(f"Missing permissions to purge {channel.id}")
+        finally:
+            for task in bulk:
+                task.cancel()
+            if old_lane is not None:
+                # the lane finishes in the background
+                old_queue.put_nowait(None)
+                self._old_lanes.append(old_lane)
+
+    async def _bulk_delete(self, channel: discord.TextChannel, message_ids: typing.List[int]):
+        # discord won't bulk delete a single message, delete_messages falls back to a normal delete
+        path = f"/channels/{channel.id}/messages/bulk-delete"
+        if len(message_ids) == 1:
+            path = f"/channels/{channel.id}/messages/{message_ids[0]}"
+        try:
+            await self.bot.outbound.send(
+                "POST" if len(message_ids) > 1 else "DELETE",
+                path,
+                functools.partial(channel.delete_messages, [discord.Object(id=m) for m in message_ids]),
+                guild_id=channel.guild.id,
+                priority=outbound.Priority.moderation,
+            )
+            self.progress.deleted[channel.id] += len(message_ids)
+        except discord.NotFound:
+            # already deleted
+            pass
+        except discord.HTTPException as e:
+            self.progress.failed += len(message_ids)
+            log.warning(f"Unable to bulk delete {len(message_ids)} messages in {channel.id}: {e}")
+        self._changed.set()
+
+    async def _old_lane(self, channel: discord.TextChannel, queue: asyncio.Queue):
+        """Delete messages one at a time, for those too old to bulk delete"""
+        while True:
+            message_id = await queue.get()
+            if message_id is None:
+                return
+            try:
+                await self.bot.outbound.send(
+                    "DELETE",
+                    f"/channels/{channel.id}/messages/{message_id}",
+                    channel.get_partial_message(message_id).delete,
+                    guild_id=channel.guild.id,
+                    priority=outbound.Priority.log,
+                )
+                self.progress.deleted[channel.id] += 1
+                self.progress.old_deleted += 1
+            except discord.NotFound:
+                pass
+            except discord.HTTPException as e:
+                self.progress.failed += 1
+                log.warning(f"Unable to delete {message_id} in {channel.id}: {e}")
+            self._changed.set()
@@ -1,4 +1,5 @@
 import enum
+import struct
 import typing
 
 import discord
@@ -6,6 +7,9 @@ from discord.ext import commands
 from discord_slash import SlashContext
 from discord_slash.utils import manage_commands
 
+if typing.TYPE_CHECKING:
+    from source.webhooks import WebhookCache
+
 
 class EventFlags(enum.IntEnum):
     memJoin = 1  # a user joined
@@ -73,6 +77,259 @@ class Action:
         self.reason: typing.Optional[str] = reason
         self.extra: typing.Any = extra
 
+    def to_record(self) -> "ActionRecord":
+        """A compact snapshot of this action, see ActionRecord"""
+        return ActionRecord.from_action(self)
+
+
+class ExtraKind(enum.IntEnum):
+    none = 0
+    role = 1
+    channel = 2
+    text = 3  # anything else, stored as its str
+
+
+class ActionRecord:
+    """
+    A compact snapshot of an Action
+
+    Only ids and the few display fields the action log needs are kept, so queued actions don't pin guilds and
+    members in memory, and can be passed between processes with `encode` and `decode`.
+    Use `resolve` to get the live discord objects back.
+    """
+
+    __slots__ = (
+        "event_type",
+        "action_type",
+        "guild_id",
+        "moderator_id",
+        "moderator_name",
+        "moderator_discriminator",
+        "moderator_bot",
+        "user_id",
+        "user_name",
+        "user_discriminator",
+        "reason",
+        "extra_kind",
+        "extra_id",
+        "extra_value",
+    )
+
+    _version = 1
+    # version, action type, flags, extra kind, guild id, moderator id, user id, extra id
+    _header = struct.Struct("<BBBBQQQQ")
+    _length = struct.Struct("<I")
+    _none = 0xFFFFFFFF
+
+    _flag_moderator_bot = 1
+    _flag_user = 2
+    _flag_moderator = 4
+
+    def __init__(
+        self,
+        event_type: str,
+        action_type: ModActions,
+        guild_id: int,
+        moderator_id: typing.Optional[int] = None,
+        moderator_name: typing.Optional[str] = None,
+        moderator_discriminator: typing.Optional[str] = None,
+        moderator_bot: bool = False,
+        user_id: typing.Optional[int] = None,
+        user_name: typing.Optional[str] = None,
+        user_discriminator: typing.Optional[str] = None,
+        reason: typing.Optional[str] = None,
+        extra_kind: ExtraKind = ExtraKind.none,
+        extra_id: typing.Optional[int] = None,
+        extra_value: typing.Optional[str] = None,
+    ):
+        self.event_type = event_type
+        self.action_type = action_type
+        self.guild_id = guild_id
+        self.moderator_id = moderator_id
+        self.moderator_name = moderator_name
+        self.moderator_discriminator = moderator_discriminator
+        self.moderator_bot = moderator_bot
+        self.user_id = user_id
+        self.user_name = user_name
+        self.user_discriminator = user_discriminator
+        self.reason = reason
+        self.extra_kind = extra_kind
+        self.extra_id = extra_id
+        self.extra_value = extra_value
+        """The name of a role or channel, or the text of anything else"""
+
+    def __repr__(self):
+        return (
+            f"<ActionRecord {ModActions(self.action_type).name} guild={self.guild_id} "
+            f"moderator={self.moderator_id} user={self.user_id}>"
+        )
+
+    @classmethod
+    def from_action(cls, action: Action) -> "ActionRecord":
+        extra = action.extra
+        extra_id = None
+        if extra is None:
+            extra_kind, extra_value = ExtraKind.none, None
+        elif isinstance(extra, discord.Role):
+            extra_kind, extra_id, extra_value = ExtraKind.role, extra.id, extra.name
+        elif isinstance(extra, discord.abc.GuildChannel):
+            extra_kind, extra_id, extra_value = ExtraKind.channel, extra.id, extra.name
+        else:
+            extra_kind, extra_value = ExtraKind.text, str(extra)
+
+        moderator, user = action.moderator, action.user
+        return cls(
+            event_type=action.event_type,
+            action_type=ModActions(action.action_type),
+            guild_id=action.guild.id,
+            moderator_id=moderator.id if moderator else None,
+            moderator_name=moderator.name if moderator else None,
+            moderator_discriminator=moderator.discriminator if moderator else None,
+            moderator_bot=moderator.bot if moderator else False,
+            user_id=user.id if user else None,
+            user_name=user.name if user else None,
+            user_discriminator=user.discriminator if user else None,
+            reason=action.reason,
+            extra_kind=extra_kind,
+            extra_id=extra_id,
+            extra_value=extra_value,
+        )
+
+    @property
+    def moderator_mention(self) -> typing.Optional[str]:
+        return f"<@{self.moderator_id}>" if self.moderator_id is not None else None
+
+    @property
+    def user_mention(self) -> typing.Optional[str]:
+        return f"<@{self.user_id}>" if self.user_id is not None else None
+
+    @property
+    def extra_mention(self) -> typing.Optional[str]:
+        if self.extra_kind == ExtraKind.role:
+            return f"<@&{self.extra_id}>"
+        if self.extra_kind == ExtraKind.channel:
+            return f"<#{self.extra_id}>"
+        return self.extra_value
+
+    def encode(self) -> bytes:
+        """Pack this record into bytes"""
+        flags = 0
+        if self.moderator_bot:
+            flags |= self._flag_moderator_bot
+        if self.user_id is not None:
+            flags |= self._flag_user
+        if self.moderator_id is not None:
+            flags |= self._flag_moderator
+
+        parts = [
+            self._header.pack(
+                self._version,
+                int(self.action_type),
+                flags,
+                int(self.extra_kind),
+                self.guild_id,
+                self.moderator_id or 0,
+                self.user_id or 0,
+                self.extra_id or 0,
+            )
+        ]
+        for value in (
+            self.event_type,
+            self.moderator_name,
+            self.moderator_discriminator,
+            self.user_name,
+            self.user_discriminator,
+            self.reason,
+            self.extra_value,
+        ):
+            if value is None:
+                parts.append(self._length.pack(self._none))
+            else:
+                value = value.encode()
+                parts.append(self._length.pack(len(value)))
+                parts.append(value)
+        return b"".join(parts)
+
+    @classmethod
+    def decode(cls, data: bytes) -> "ActionRecord":
+        """Unpack a record made by `encode`"""
+        version, action_type, flags, extra_kind, guild_id, moderator_id, user_id, extra_id = cls._header.unpack_from(
+            data
+        )
+        if version != cls._version:
+            raise ValueError(f"Unknown action record version {version}")
+
+        offset = cls._header.size
+        strings = []
+        for _ in range(7):
+            (length,) = cls._length.unpack_from(data, offset)
+            offset += cls._length.size
+            if length == cls._none:
+                strings.append(None)
+                continue
+            strings.append(data[offset : offset + length].decode())
+            offset += length
+        (
+            event_type,
+            moderator_name,
+            moderator_discriminator,
+            user_name,
+            user_discriminator,
+            reason,
+            extra_value,
+        ) = strings
+
+        extra_kind = ExtraKind(extra_kind)
+        return cls(
+            event_type=event_type,
+            action_type=ModActions(action_type),
+            guild_id=guild_id,
+            moderator_id=moderator_id if flags & cls._flag_moderator else None,
+            moderator_name=moderator_name,
+            moderator_discriminator=moderator_discriminator,
+            moderator_bot=bool(flags & cls._flag_moderator_bot),
+            user_id=user_id if flags & cls._flag_user else None,
+            user_name=user_name,
+            user_discriminator=user_discriminator,
+            reason=reason,
+            extra_kind=extra_kind,
+            extra_id=extra_id if extra_kind in (ExtraKind.role, ExtraKind.channel) else None,
+            extra_value=extra_value,
+        )
+
+    async def resolve(self, bot: commands.Bot, fetch: bool = False) -> typing.Optional[Action]:
+        """Re-hydrate the live action from the cache, returns None if the guild is no longer available
+
+        :param fetch if True, users who aren't cached (ie. kicked or banned) are fetched from discord
+        """
+        guild: discord.Guild = bot.get_guild(self.guild_id)
+        if guild is None:
+            return None
+
+        async def get_user(user_id):
+            if user_id is None:
+                return None
+            user = guild.get_member(user_id) or bot.get_user(user_id)
+            if user is None and fetch:
+                user = await bot.fetch_user(user_id)
+            return user
+
+        extra = self.extra_value
+        if self.extra_kind == ExtraKind.role:
+            extra = guild.get_role(self.extra_id)
+        elif self.extra_kind == ExtraKind.channel:
+            extra = guild.get_channel(self.extra_id)
+
+        return Action(
+            actionType=self.action_type,
+            moderator=await get_user(self.moderator_id),
+            guild=guild,
+            user=await get_user(self.user_id),
+            event_type=self.event_type,
+            reason=self.reason,
+            extra=extra,
+        )
+
 
 reasonOption = manage_commands.create_option(
     name="reason",
@@ -107,8 +364,22 @@ def check_is_moderator():
     return commands.check(sub_check)
 
 
-async def send_with_webhook(name: str, channel: discord.TextChannel, embed: discord.Embed = None, file=None):
-    """Sends content as a webhook to the desired channel"""
+async def send_with_webhook(
+    name: str, channel: discord.TextChannel, embed: discord.Embed = None, file=None, cache: "WebhookCache" = None
+):
+    """Sends content as a webhook to the desired channel
+
+    :param cache if given, the hook is looked up in the cache rather than listing the channel's webhooks
+    """
+    kwargs = dict(
+        embed=embed,
+        allowed_mentions=discord.AllowedMentions(everyone=False, roles=True, users=False),
+        avatar_url=channel.guild.icon_url,
+        file=file,
+    )
+    if cache is not None:
+        return await cache.send(channel, name, **kwargs)
+
     for _hook in await channel.webhooks():
         if _hook.name == name:
             hook: discord.Webhook = _hook
@@ -116,12 +387,7 @@ async def send_with_webhook(name: str, channel: discord.TextChannel, embed: disc
     else:
         hook: discord.Webhook = await channel.create_webhook(name=name)
 
-    await hook.send(
-        embed=embed,
-        allowed_mentions=discord.AllowedMentions(everyone=False, roles=True, users=False),
-        avatar_url=channel.guild.icon_url,
-        file=file,
-    )
+    await hook.send(**kwargs)
 
 
 new_blurple = discord.Colour(0x5865F2)
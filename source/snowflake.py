@@ -0,0 +1,173 @@
+import bisect
+import time
+import typing
+from array import array
+from datetime import datetime, timezone
+
+discord_epoch = 1420070400000
+"""The first millisecond of 2015, discord snowflakes count from here"""
+
+_low_bits = (1 << 22) - 1
+
+
+def from_timestamp(timestamp: float, high: bool = False) -> int:
+    """The snowflake of a unix timestamp
+
+    :param high if set, the highest snowflake of that millisecond, otherwise the lowest
+    """
+    snowflake = max(int(timestamp * 1000) - discord_epoch, 0) << 22
+    return snowflake + _low_bits if high else snowflake
+
+
+def from_datetime(date: datetime, high: bool = False) -> int:
+    """The snowflake of a datetime, naive datetimes are assumed to be utc"""
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return from_timestamp(date.timestamp(), high=high)
+
+
+def to_timestamp(snowflake: int) -> float:
+    """The unix timestamp a snowflake was made at"""
+    return ((snowflake >> 22) + discord_epoch) / 1000
+
+
+def to_datetime(snowflake: int) -> datetime:
+    """The naive utc datetime a snowflake was made at"""
+    return datetime.utcfromtimestamp(to_timestamp(snowflake))
+
+
+def ago(seconds: float) -> int:
+    """The lowest snowflake made `seconds` ago"""
+    return from_timestamp(time.time() - seconds)
+
+
+class SnowflakeIndex:
+    """
+    A sorted set of snowflakes, stored compactly as an array of unsigned 64 bit ints
+
+    Snowflakes mostly arrive in order, so adding is usually an append, range queries are a bisect
+    """
+
+    __slots__ = ("_ids",)
+
+    def __init__(self, snowflakes: typing.Iterable[int] = ()):
+        self._ids = array("Q", sorted(set(snowflakes)))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, snowflake: int):
+        i = bisect.bisect_left(self._ids, snowflake)
+        return i < len(self._ids) and self._ids[i] == snowflake
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __getitem__(self, i):
+        return self._ids[i]
+
+    @property
+    def oldest(self) -> typing.Optional[int]:
+        return self._ids[0] if self._ids else None
+
+    def add(self, snowflake: int):
+        if not self._ids or snowflake > self._ids[-1]:
+            self._ids.append(snowflake)
+            return
+        i = bisect.bisect_left(self._ids, snowflake)
+        if i == len(self._ids) or self._ids[i] != snowflake:
+            self._ids.insert(i, snowflake)
+
+    def discard(self, snowflake: int):
+        i = bisect.bisect_left(self._ids, snowflake)
+        if i < len(self._ids) and self._ids[i] == snowflake:
+            del self._ids[i]
+
+    def range(self, after: int = 0, before: typing.Optional[int] = None) -> array:
+        """The snowflakes between `after` and `before`, both exclusive, oldest first"""
+        start = bisect.bisect_right(self._ids, after)
+        end = len(self._ids) if before is None else bisect.bisect_left(self._ids, before)
+        return self._ids[start:end]
+
+    def count(self, after: int = 0, before: typing.Optional[int] = None) -> int:
+        start = bisect.bisect_right(self._ids, after)
+        end = len(self._ids) if before is None else bisect.bisect_left(self._ids, before)
+        return max(end - start, 0)
+
+    def trim(self, before: int) -> int:
+        """Remove every snowflake older than `before`, returns how many were removed"""
+        end = bisect.bisect_left(self._ids, before)
+        del self._ids[:end]
+        return end
+
+
+class ChannelIndex:
+    """
+    The ids of recent messages, per channel, kept from the gateway so recent history can be queried without REST
+
+    An index only knows about messages sent while it was watching, `covers` says if a query can be trusted
+
+    :param max_per_channel the most ids kept per channel, the oldest are dropped beyond this
+    :param max_age how long, in seconds, ids are kept
+    """
+
+    def __init__(self, max_per_channel: int = 10_000, max_age: float = 14 * 24 * 60 * 60):
+        self.max_per_channel = max_per_channel
+        self.max_age = max_age
+
+        self.watching_since: typing.Optional[int] = None
+        """Every message after this snowflake has been seen, None until `reset` is called"""
+
+        self._channels: typing.Dict[int, SnowflakeIndex] = {}
+        # channel id -> the snowflake the channel's index is complete after, bumped when ids are dropped
+        self._floors: typing.Dict[int, int] = {}
+
+    def __getitem__(self, channel_id: int) -> SnowflakeIndex:
+        return self._channels.get(channel_id) or SnowflakeIndex()
+
+    def add(self, channel_id: int, message_id: int):
+        index = self._channels.get(channel_id)
+        if index is None:
+            index = self._channels[channel_id] = SnowflakeIndex()
+        index.add(message_id)
+
+        if len(index) > self.max_per_channel:
+            # drop the oldest quarter, rather than trimming on every message
+            cutoff = index[len(index) // 4]
+            index.trim(cutoff)
+            self._floors[channel_id] = cutoff - 1
+
+    def discard(self, channel_id: int, *message_ids: int):
+        index = self._channels.get(channel_id)
+        if index is not None:
+            for message_id in message_ids:
+                index.discard(message_id)
+
+    def forget(self, channel_id: int):
+        self._channels.pop(channel_id, None)
+        self._floors.pop(channel_id, None)
+
+    def reset(self):
+        """Start watching from now, call whenever messages may have been missed, ie. on a new gateway session"""
+        self.watching_since = ago(0)
+        self._channels.clear()
+        self._floors.clear()
+
+    def floor(self, channel_id: int) -> typing.Optional[int]:
+        if self.watching_since is None:
+            return None
+        return max(self.watching_since, self._floors.get(channel_id, 0))
+
+    def covers(self, channel_id: int, after: int) -> bool:
+        """Does the index hold every message in a channel after this snowflake"""
+        floor = self.floor(channel_id)
+        return floor is not None and after >= floor
+
+    def expire(self):
+        """Drop ids older than `max_age`"""
+        cutoff = ago(self.max_age)
+        for channel_id, index in list(self._channels.items()):
+            if index.trim(cutoff):
+                self._floors[channel_id] = max(self._floors.get(channel_id, 0), cutoff - 1)
+            if not index:
+                del self._channels[channel_id]
@@ -0,0 +1,139 @@
+import asyncio
+import heapq
+import itertools
+import time
+import traceback
+import typing
+from datetime import datetime
+
+from source import utilities
+
+log = utilities.getLog("timers")
+
+epoch = datetime(1970, 1, 1)
+
+
+class TimerScheduler:
+    """A lightweight scheduler for one-shot timers
+
+    Timers are held in a single min-heap keyed by due time and serviced by one sleeping task, so adding,
+    rescheduling and cancelling a timer is O(log n). Cancelled and rescheduled entries are left in the heap
+    and discarded when they reach the top.
+
+    :param callback the coroutine function called with the key of each timer when it is due
+    :param batch_size the most timers fired at once, timers that came due while offline are caught up in batches
+    """
+
+    def __init__(self, callback: typing.Callable[[typing.Hashable], typing.Awaitable], batch_size: int = 100):
+        self.callback = callback
+        self.batch_size = batch_size
+
+        self._heap: list = []
+        # key -> (due, sequence) for live timers, the sequence identifies the heap entry that is current
+        self._timers: typing.Dict[typing.Hashable, typing.Tuple[float, int]] = {}
+        self._sequence = itertools.count()
+
+        self._wakeup: typing.Optional[asyncio.Event] = None
+        self._task: typing.Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @staticmethod
+    def to_timestamp(due: typing.Union[datetime, float]) -> float:
+        """Convert a naive utc datetime to a timestamp, timestamps are passed through"""
+        if isinstance(due, datetime):
+            return (due - epoch).total_seconds()
+        return float(due)
+
+    def start(self):
+        """Start servicing timers, must be called from inside the event loop"""
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def shutdown(self, wait=False):
+        """Stop servicing timers, pending timers are kept"""
+        if self._task is not None:
+            self._task.cancel()
+        self._task = None
+
+    def schedule(self, key: typing.Hashable, due: typing.Union[datetime, float]):
+        """Schedule a timer, replacing any existing timer with the same key"""
+        due = self.to_timestamp(due)
+        sequence = next(self._sequence)
+
+        self._timers[key] = (due, sequence)
+        heapq.heappush(self._heap, (due, sequence, key))
+
+        # stale entries are normally discarded lazily, but don't let them pile up
+        if len(self._heap) > 2 * len(self._timers) + 1024:
+            self._compact()
+
+        if self._wakeup is not None and self._heap[0][1] == sequence:
+            # this is the new earliest timer, the runner needs to sleep for less time
+            self._wakeup.set()
+
+    def cancel(self, key: typing.Hashable) -> bool:
+        """Cancel a timer, returns if there was one to cancel"""
+        return self._timers.pop(key, None) is not None
+
+    def get(self, key: typing.Hashable) -> typing.Optional[float]:
+        """Get the timestamp a timer is due at"""
+        timer = self._timers.get(key)
+        return timer[0] if timer else None
+
+    def _compact(self):
+        self._heap = [(due, sequence, key) for key, (due, sequence) in self._timers.items()]
+        heapq.heapify(self._heap)
+
+    def _discard_stale(self):
+        while self._heap:
+            due, sequence, key = self._heap[0]
+            timer = self._timers.get(key)
+            if timer is not None and timer[1] == sequence:
+                return
+            heapq.heappop(self._heap)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            self._discard_stale()
+
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            now = time.time()
+            batch = []
+            while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+                due, sequence, key = heapq.heappop(self._heap)
+                timer = self._timers.get(key)
+                if timer is None or timer[1] != sequence:
+                    continue
+                del self._timers[key]
+                batch.append(key)
+
+            await asyncio.gather(*[self._fire(key) for key in batch])
+
+    async def _fire(self, key):
+        try:
+            await self.callback(key)
+        except Exception as e:
+            log.error(f"Error running timer {key}:\n{''.join(traceback.format_exception(type(e), e, e.__traceback__))}")
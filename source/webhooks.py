@@ -0,0 +1,266 @@
+import asyncio
+import functools
+import json
+import traceback
+import typing
+
+import aiohttp
+import discord
+
+from source import outbound, utilities
+
+log = utilities.getLog("webhooks")
+
+
+class WebhookCache:
+    """
+    Remembers the webhook the bot uses in each channel, so sending doesn't need a `channel.webhooks()` lookup
+
+    Hooks are kept in memory, and their id and token in redis under `webhook||{channel_id}` (a hash of name to
+    "id|token") so they survive restarts. A hook that discord reports as unknown is forgotten, and found or
+    created again on the next send.
+
+    :param bot the bot
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+
+        self._hooks: typing.Dict[typing.Tuple[int, str], discord.Webhook] = {}
+        # stops concurrent sends to a new channel from each creating a hook
+        self._locks: typing.Dict[typing.Tuple[int, str], asyncio.Lock] = {}
+
+    @staticmethod
+    def _key(channel_id: int) -> str:
+        return f"webhook||{channel_id}"
+
+    def _from_token(self, channel: discord.TextChannel, hook_id: int, token: str) -> discord.Webhook:
+        data = {"id": hook_id, "token": token, "type": 1, "channel_id": channel.id, "guild_id": channel.guild.id}
+        return discord.Webhook.from_state(data, state=self.bot._connection)
+
+    async def _load(self, channel: discord.TextChannel, name: str) -> typing.Optional[discord.Webhook]:
+        """Load a hook stored in redis"""
+        try:
+            (stored,) = await self.bot.redis.hmget(self._key(channel.id), [name])
+        except Exception as e:
+            log.warning(f"Unable to load webhook for {channel.id}: {e}")
+            return None
+        if not stored:
+            return None
+        hook_id, token = stored.decode().split("|", 1)
+        return self._from_token(channel, int(hook_id), token)
+
+    async def _store(self, channel: discord.TextChannel, name: str, hook: discord.Webhook):
+        try:
+            await self.bot.redis.hset(self._key(channel.id), {name: f"{hook.id}|{hook.token}"})
+        except Exception as e:
+            log.warning(f"Unable to store webhook for {channel.id}: {e}")
+
+    async def _find_or_create(self, channel: discord.TextChannel, name: str) -> discord.Webhook:
+        """Look for our hook in the channel, creating one if there isn't one"""
+        for _hook in await channel.webhooks():
+            # hooks made by other users, or other apps, don't come with a token
+            if _hook.name == name and _hook.token:
+                return _hook
+        log.debug(f"Creating webhook in {channel.id}")
+        return await channel.create_webhook(name=name)
+
+    async def get(self, channel: discord.TextChannel, name: str) -> discord.Webhook:
+        """Get the hook to use for a channel"""
+        key = (channel.id, name)
+        hook = self._hooks.get(key)
+        if hook is not None:
+            return hook
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            hook = self._hooks.get(key)
+            if hook is None:
+                hook = await self._load(channel, name)
+                if hook is None:
+                    hook = await self._find_or_create(channel, name)
+                    await self._store(channel, name, hook)
+                self._hooks[key] = hook
+        self._locks.pop(key, None)
+        return hook
+
+    async def invalidate(self, channel_id: int, name: str):
+        """Forget a channel's hook, ie. because it was deleted"""
+        self._hooks.pop((channel_id, name), None)
+        try:
+            await self.bot.redis.hdel(self._key(channel_id), name)
+        except Exception as e:
+            log.warning(f"Unable to remove webhook for {channel_id}: {e}")
+
+    async def _send(self, hook: discord.Webhook, channel: discord.TextChannel, priority: outbound.Priority, kwargs):
+        return await self.bot.outbound.send(
+            "POST",
+            f"/webhooks/{hook.id}/{hook.token}",
+            functools.partial(hook.send, **kwargs),
+            guild_id=channel.guild.id,
+            priority=priority,
+        )
+
+    async def send(
+        self, channel: discord.TextChannel, name: str, priority: outbound.Priority = outbound.Priority.log, **kwargs
+    ):
+        """Send through the channel's hook, if discord doesn't know the hook it is replaced once"""
+        hook = await self.get(channel, name)
+        try:
+            return await self._send(hook, channel, priority, kwargs)
+        except discord.NotFound:
+            log.info(f"Webhook for {channel.id} no longer exists, replacing it")
+            await self.invalidate(channel.id, name)
+
+        if kwargs.get("file") is not None:
+            kwargs["file"].reset()
+        hook = await self.get(channel, name)
+        return await self._send(hook, channel, priority, kwargs)
+
+
+class WebhookBatcher:
+    """
+    Gathers embeds bound for a channel's webhook and sends them together, up to 10 per message
+
+    A channel's queue is flushed `window` seconds after its first embed arrives, or straight away once it holds
+    `max_embeds`. Queues are kept in redis lists under `webhook_queue||{channel_id}`, so anything not sent when
+    the process stops is sent after `recover` is called on the next start.
+
+    :param bot the bot, its WebhookCache is used to send
+    :param name the name of the webhook
+    :param window how long, in seconds, to wait for more embeds before sending
+    :param max_embeds the most embeds sent in one message, discord allows 10
+    :param max_chars the most characters sent in one message, discord allows 6000 across all embeds
+    """
+
+    def __init__(self, bot, name: str, window: float = 2, max_embeds: int = 10, max_chars: int = 6000):
+        self.bot = bot
+        self.name = name
+        self.window = window
+        self.max_embeds = max_embeds
+        self.max_chars = max_chars
+
+        self._tasks: typing.Dict[int, asyncio.Task] = {}
+        self._full: typing.Dict[int, asyncio.Event] = {}
+        self._locks: typing.Dict[int, asyncio.Lock] = {}
+        # channels that have had embeds added since their last flush began
+        self._dirty: typing.Set[int] = set()
+
+    @staticmethod
+    def _key(channel_id: int) -> str:
+        return f"webhook_queue||{channel_id}"
+
+    async def add(self, channel: discord.TextChannel, embed: discord.Embed):
+        """Queue an embed to be sent to a channel"""
+        length = await self.bot.redis.rpush(self._key(channel.id), json.dumps(embed.to_dict()))
+        self._dirty.add(channel.id)
+        if length >= self.max_embeds:
+            self._full.setdefault(channel.id, asyncio.Event()).set()
+        self._start(channel.id)
+
+    async def recover(self):
+        """Start sending any queues left over from a previous run, for channels this process can see"""
+        async for key in self.bot.redis.scan_iter(self._key("*")):
+            channel_id = int(key.decode().split("||", 1)[1])
+            if self.bot.get_channel(channel_id) is None:
+                # another shard's channel, its own process will send it
+                continue
+            self._dirty.add(channel_id)
+            self._start(channel_id)
+
+    def _start(self, channel_id: int):
+        task = self._tasks.get(channel_id)
+        if task is None or task.done():
+            self._tasks[channel_id] = asyncio.create_task(self._run(channel_id))
+
+    async def _run(self, channel_id: int):
+        full = self._full.setdefault(channel_id, asyncio.Event())
+        try:
+            while channel_id in self._dirty:
+                try:
+                    await asyncio.wait_for(full.wait(), timeout=self.window)
+                except asyncio.TimeoutError:
+                    pass
+                full.clear()
+                await self.flush(channel_id)
+        finally:
+            if self._tasks.get(channel_id) is asyncio.current_task():
+                del self._tasks[channel_id]
+                self._full.pop(channel_id, None)
+
+    async def flush(self, channel_id: int):
+        """Send everything queued for a channel now"""
+        lock = self._locks.setdefault(channel_id, asyncio.Lock())
+        async with lock:
+            self._dirty.discard(channel_id)
+            try:
+                while await self._send_batch(channel_id):
+                    pass
+            except (aiohttp.ClientError, asyncio.TimeoutError, discord.HTTPException) as e:
+                # discord is struggling, leave the queue as it is and try again after the next window
+                log.warning(f"Unable to send webhook batch to {channel_id}: {e}")
+                self._dirty.add(channel_id)
+
+    async def _send_batch(self, channel_id: int) -> bool:
+        """Send the next batch for a channel, returns False once the queue is empty"""
+        key = self._key(channel_id)
+        raw_embeds = await self.bot.redis.lrange(key, 0, self.max_embeds - 1)
+        if not raw_embeds:
+            return False
+
+        channel: discord.TextChannel = self.bot.get_channel(channel_id)
+        if channel is None:
+            log.info(f"Dropping {len(raw_embeds)}+ queued embeds for missing channel {channel_id}")
+            await self.bot.redis.delete(key)
+            return False
+
+        embeds = []
+        consumed = 0
+        chars = 0
+        for raw in raw_embeds:
+            try:
+                embed = discord.Embed.from_dict(json.loads(raw))
+            except Exception as e:
+                log.error(f"Dropping malformed embed queued for {channel_id}: {e}")
+                consumed += 1
+                continue
+            if embeds and chars + len(embed) > self.max_chars:
+                break
+            embeds.append(embed)
+            chars += len(embed)
+            consumed += 1
+
+        if embeds:
+            try:
+                await self.bot.webhooks.send(
+                    channel,
+                    self.name,
+                    embeds=embeds,
+                    allowed_mentions=discord.AllowedMentions(everyone=False, roles=True, users=False),
+                    avatar_url=channel.guild.icon_url,
+                )
+            except discord.HTTPException as e:
+                if e.status == 429 or e.status >= 500:
+                    raise
+                # discord won't accept this batch (ie. missing permissions), sending it again wont help
+                log.error(
+                    f"Dropping {len(embeds)} embeds for {channel_id}:\n"
+                    f"{''.join(traceback.format_exception(type(e), e, e.__traceback__))}"
+                )
+
+        await self.bot.redis.ltrim(key, consumed, -1)
+        return True
+
+    async def close(self, timeout: float = 5):
+        """Stop batching, sending what is queued if that can be done within `timeout` seconds"""
+        channel_ids = list(self._tasks)
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        if not channel_ids:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*[self.flush(c) for c in channel_ids]), timeout=timeout)
+        except asyncio.TimeoutError:
+            # whatever is left is still in redis, and is sent after the next start
+            log.warning("Timed out flushing webhook batches")
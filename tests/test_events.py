@@ -0,0 +1,186 @@
+import asyncio
+import typing
+
+import pytest
+
+pytest.importorskip("discord")
+
+from source import events
+
+Priority = events.Priority
+OverflowPolicy = events.OverflowPolicy
+
+
+def run_queue(
+    maxsize: int, policy: OverflowPolicy, *items, on_drop=None
+) -> typing.Tuple[events.EventQueue, dict, list]:
+    """Put (item, priority) pairs into a new queue in order, then close it and take everything out"""
+    queue = events.EventQueue(maxsize, policy, on_drop=on_drop)
+
+    async def main():
+        for item, priority in items:
+            await queue.put(item, priority)
+        stats = queue.stats()
+        await queue.close()
+        taken = []
+        while (item := await queue.get()) is not events._shutdown:
+            taken.append(item)
+        return stats, taken
+
+    stats, taken = asyncio.run(main())
+    return queue, stats, taken
+
+
+def test_higher_priority_drained_first():
+    queue, stats, taken = run_queue(
+        10,
+        OverflowPolicy.drop_oldest,
+        ("a1", Priority.automatic),
+        ("m1", Priority.moderator),
+        ("a2", Priority.automatic),
+    )
+    assert taken == ["m1", "a1", "a2"]
+
+
+def test_drop_oldest_drops_lowest_priority():
+    dropped = []
+    queue, stats, taken = run_queue(
+        3,
+        OverflowPolicy.drop_oldest,
+        ("m1", Priority.moderator),
+        ("a1", Priority.automatic),
+        ("a2", Priority.automatic),
+        ("m2", Priority.moderator),
+        on_drop=dropped.append,
+    )
+
+    assert dropped == ["a1"]
+    assert queue.dropped[Priority.automatic] == 1
+    assert taken == ["m1", "m2", "a2"]
+
+
+def test_drop_oldest_drops_moderator_items_when_nothing_else_is_queued():
+    queue, stats, taken = run_queue(
+        2,
+        OverflowPolicy.drop_oldest,
+        ("m1", Priority.moderator),
+        ("m2", Priority.moderator),
+        ("m3", Priority.moderator),
+    )
+
+    assert queue.dropped[Priority.moderator] == 1
+    assert taken == ["m2", "m3"]
+
+
+def test_coalesce_only_queues_identical_strings_once():
+    record = object()
+    queue, stats, taken = run_queue(
+        10,
+        OverflowPolicy.coalesce,
+        ("refresh", Priority.automatic),
+        ("refresh", Priority.automatic),
+        (record, Priority.automatic),
+        (record, Priority.automatic),
+    )
+
+    assert queue.coalesced == 1
+    assert taken == ["refresh", record, record]
+
+
+def test_block_waits_for_space():
+    async def main():
+        queue = events.EventQueue(1, OverflowPolicy.block)
+        await queue.put("first")
+        put = asyncio.create_task(queue.put("second"))
+        await asyncio.sleep(0.01)
+        assert not put.done()
+        assert queue.blocked == 1
+
+        assert await queue.get() == "first"
+        await asyncio.wait_for(put, 1)
+        assert await queue.get() == "second"
+        assert queue.dropped == {p: 0 for p in Priority}
+
+    asyncio.run(main())
+
+
+def test_policy_can_be_overridden_per_item():
+    async def main():
+        queue = events.EventQueue(1, OverflowPolicy.drop_oldest)
+        await queue.put("first")
+        put = asyncio.create_task(queue.put("second", policy=OverflowPolicy.block))
+        await asyncio.sleep(0.01)
+        assert not put.done()
+
+        assert await queue.get() == "first"
+        await asyncio.wait_for(put, 1)
+
+    asyncio.run(main())
+
+
+def test_closed_queue_rejects_items():
+    async def main():
+        queue = events.EventQueue(10)
+        await queue.put("before")
+        await queue.close()
+        await queue.put("after")
+        assert await queue.get() == "before"
+        assert await queue.get() is events._shutdown
+
+    asyncio.run(main())
+
+
+def test_stats():
+    queue, stats, taken = run_queue(1, OverflowPolicy.drop_oldest, ("a", Priority.automatic), ("b", Priority.automatic))
+    assert stats["depth"] == {"moderator": 0, "automatic": 1}
+    assert stats["dropped"] == {"moderator": 0, "automatic": 1}
+
+
+class FakeStream:
+    """Records what PaladinEvents acknowledges and releases"""
+
+    def __init__(self):
+        self.acked = []
+        self.released = []
+
+    async def ack(self, entry_id):
+        self.acked.append(entry_id)
+
+    def release(self, entry_id):
+        self.released.append(entry_id)
+
+
+def test_stream_entries_only_acked_when_subscribers_succeed():
+    async def main():
+        paladin_events = events.PaladinEvents()
+        paladin_events.stream = stream = FakeStream()
+
+        async def fails():
+            raise RuntimeError("boom")
+
+        async def succeeds():
+            pass
+
+        paladin_events.subscribe_to_event(fails, "bad")
+        paladin_events.subscribe_to_event(succeeds, "good")
+
+        await paladin_events._dispatch(events.StreamEntry(b"1", "bad"))
+        await paladin_events._dispatch(events.StreamEntry(b"2", "good"))
+        return stream
+
+    stream = asyncio.run(main())
+    assert stream.acked == [b"2"]
+    assert stream.released == [b"1"]
+
+
+def test_dropped_stream_entries_are_released():
+    async def main():
+        paladin_events = events.PaladinEvents(maxsize=1)
+        paladin_events.stream = stream = FakeStream()
+
+        await paladin_events._queue.put(events.StreamEntry(b"1", "event"), Priority.automatic)
+        await paladin_events.add_item("other")
+        return stream
+
+    stream = asyncio.run(main())
+    assert stream.released == [b"1"]
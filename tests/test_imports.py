@@ -0,0 +1,36 @@
+import os
+import pkgutil
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("discord")
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+modules = sorted(f"source.{m.name}" for m in pkgutil.iter_modules([os.path.join(root, "source")]))
+cogs = sorted(f"source.cogs.{m.name}" for m in pkgutil.iter_modules([os.path.join(root, "source", "cogs")]))
+
+
+def import_fresh(*names: str):
+    """Import modules in a new interpreter, so import cycles show up whatever was imported before"""
+    result = subprocess.run(
+        [sys.executable, "-c", "; ".join(f"import {name}" for name in names)],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+
+
+@pytest.mark.parametrize("module", modules)
+def test_module_imports(module):
+    import_fresh(module)
+
+
+@pytest.mark.parametrize("cog", cogs)
+def test_cog_imports(cog):
+    # cogs rely on the slash command patches the bot applies, as when they're loaded as extensions
+    import_fresh("source.bot", cog)
@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+import pytest
+import regex
+
+pytest.importorskip("discord")
+
+from source import purgeEngine, snowflake
+from source.purgeEngine import Content, PurgeFilter
+
+
+def message(author_id: int = 1, content: str = "", attachments: list = ()):
+    """Only the fields a filter reads"""
+    return SimpleNamespace(author=SimpleNamespace(id=author_id), content=content, attachments=list(attachments))
+
+
+def test_empty_filter_matches_everything():
+    purge_filter = PurgeFilter()
+    assert purge_filter.by_id
+    assert purge_filter(message())
+
+
+def test_before_defaults_to_now():
+    purge_filter = PurgeFilter()
+    assert abs(snowflake.to_timestamp(purge_filter.before) - snowflake.to_timestamp(snowflake.ago(0))) < 1
+
+
+def test_authors():
+    purge_filter = PurgeFilter(authors={1, 2})
+    assert not purge_filter.by_id
+    assert purge_filter(message(author_id=2))
+    assert not purge_filter(message(author_id=3))
+
+
+def test_pattern():
+    purge_filter = PurgeFilter(pattern=regex.compile(r"free \w+"))
+    assert not purge_filter.by_id
+    assert purge_filter(message(content="get your free nitro"))
+    assert not purge_filter(message(content="hello"))
+
+
+def test_slow_pattern_times_out():
+    purge_filter = PurgeFilter(pattern=regex.compile(r"(a|aa)+$"), match_timeout=0.01)
+    with pytest.raises(purgeEngine.PatternTimeout):
+        purge_filter(message(content="a" * 60 + "b"))
+
+
+@pytest.mark.parametrize(
+    "content, attachments, expected",
+    [
+        (Content.attachments, True, True),
+        (Content.attachments, False, False),
+        (Content.links, False, True),
+        (Content.either, True, True),
+    ],
+)
+def test_content_with_attachment_or_link(content, attachments, expected):
+    purge_filter = PurgeFilter(content=content)
+    text = "no link here" if attachments else "see https://example.com"
+    assert purge_filter(message(content=text, attachments=["file"] if attachments else [])) is expected
+
+
+def test_links_without_a_link():
+    assert not PurgeFilter(content=Content.links)(message(content="no link here", attachments=["file"]))
+    assert not PurgeFilter(content=Content.either)(message(content="no link here"))
+
+
+def test_every_condition_must_match():
+    purge_filter = PurgeFilter(authors={1}, pattern=regex.compile("spam"), content=Content.links)
+    assert purge_filter(message(author_id=1, content="spam https://example.com"))
+    assert not purge_filter(message(author_id=2, content="spam https://example.com"))
+    assert not purge_filter(message(author_id=1, content="spam"))
+    assert not purge_filter(message(author_id=1, content="https://example.com"))
+
+
+def test_describe():
+    after = snowflake.from_timestamp(1_600_000_000)
+    lines = PurgeFilter(authors={1}, pattern=regex.compile("spam"), content=Content.either, after=after).describe()
+    assert lines == [
+        "From <@1>",
+        "Matching `spam`",
+        "With attachments or links",
+        "Sent after 2020-09-13 12:26 UTC",
+    ]
@@ -0,0 +1,91 @@
+import struct
+
+import pytest
+
+pytest.importorskip("discord")
+
+from source.shared import ActionRecord, ExtraKind, ModActions
+
+fields = ActionRecord.__slots__
+
+
+def assert_same(a: ActionRecord, b: ActionRecord):
+    assert {f: getattr(a, f) for f in fields} == {f: getattr(b, f) for f in fields}
+
+
+def test_round_trip():
+    record = ActionRecord(
+        event_type="modAction",
+        action_type=ModActions.roleGive,
+        guild_id=2**63,
+        moderator_id=111,
+        moderator_name="mod",
+        moderator_discriminator="0001",
+        moderator_bot=True,
+        user_id=222,
+        user_name="user",
+        user_discriminator="1234",
+        reason="spamming\nlinks",
+        extra_kind=ExtraKind.role,
+        extra_id=333,
+        extra_value="Muted",
+    )
+    decoded = ActionRecord.decode(record.encode())
+    assert_same(record, decoded)
+    assert isinstance(decoded.action_type, ModActions)
+    assert isinstance(decoded.extra_kind, ExtraKind)
+
+
+def test_round_trip_without_optional_fields():
+    record = ActionRecord("modAction", ModActions.purge, 1)
+    decoded = ActionRecord.decode(record.encode())
+    assert_same(record, decoded)
+    assert decoded.moderator_id is None
+    assert decoded.user_id is None
+    assert decoded.reason is None
+    assert decoded.moderator_bot is False
+
+
+def test_empty_strings_are_not_none():
+    record = ActionRecord("modAction", ModActions.warn, 1, reason="", user_name="")
+    decoded = ActionRecord.decode(record.encode())
+    assert decoded.reason == ""
+    assert decoded.user_name == ""
+
+
+def test_unicode():
+    record = ActionRecord("modAction", ModActions.ban, 1, user_name="ｕｓｅｒ 🛡", reason="naïve ✓")
+    assert_same(record, ActionRecord.decode(record.encode()))
+
+
+def test_extra_id_only_kept_for_roles_and_channels():
+    record = ActionRecord("modAction", ModActions.warn, 1, extra_kind=ExtraKind.text, extra_id=5, extra_value="x")
+    decoded = ActionRecord.decode(record.encode())
+    assert decoded.extra_id is None
+    assert decoded.extra_value == "x"
+
+    record = ActionRecord("modAction", ModActions.purge, 1, extra_kind=ExtraKind.channel, extra_id=5, extra_value="c")
+    assert ActionRecord.decode(record.encode()).extra_id == 5
+
+
+def test_unknown_version_is_rejected():
+    data = bytearray(ActionRecord("modAction", ModActions.kick, 1).encode())
+    data[0] = ActionRecord._version + 1
+    with pytest.raises(ValueError):
+        ActionRecord.decode(bytes(data))
+
+
+def test_truncated_data_is_rejected():
+    data = ActionRecord("modAction", ModActions.kick, 1, reason="reason").encode()
+    with pytest.raises(struct.error):
+        ActionRecord.decode(data[: ActionRecord._header.size + 2])
+
+
+def test_mentions():
+    record = ActionRecord(
+        "modAction", ModActions.roleRem, 1, moderator_id=2, user_id=3, extra_kind=ExtraKind.role, extra_id=4
+    )
+    assert record.moderator_mention == "<@2>"
+    assert record.user_mention == "<@3>"
+    assert record.extra_mention == "<@&4>"
+    assert ActionRecord("modAction", ModActions.kick, 1).user_mention is None
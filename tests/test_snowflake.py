@@ -0,0 +1,125 @@
+import time
+from datetime import datetime
+
+from source import snowflake
+from source.snowflake import ChannelIndex, SnowflakeIndex
+
+
+def test_timestamp_round_trip():
+    now = time.time()
+    assert snowflake.to_timestamp(snowflake.from_timestamp(now)) == int(now * 1000) / 1000
+
+
+def test_high_snowflake_is_last_of_its_millisecond():
+    low = snowflake.from_timestamp(1_600_000_000)
+    high = snowflake.from_timestamp(1_600_000_000, high=True)
+    assert high - low == (1 << 22) - 1
+    assert snowflake.to_timestamp(low) == snowflake.to_timestamp(high)
+
+
+def test_datetimes_are_utc():
+    date = datetime(2021, 6, 1, 12, 30)
+    assert snowflake.to_datetime(snowflake.from_datetime(date)) == date
+
+
+def test_before_discord_epoch_is_zero():
+    assert snowflake.from_timestamp(0) == 0
+
+
+def test_index_keeps_snowflakes_sorted_and_unique():
+    index = SnowflakeIndex([5, 1, 3, 3])
+    for s in (7, 2, 7, 6):
+        index.add(s)
+
+    assert list(index) == [1, 2, 3, 5, 6, 7]
+    assert len(index) == 6
+    assert index.oldest == 1
+    assert 5 in index
+    assert 4 not in index
+
+
+def test_index_discard():
+    index = SnowflakeIndex([1, 2, 3])
+    index.discard(2)
+    index.discard(10)
+    assert list(index) == [1, 3]
+
+
+def test_index_range_is_exclusive():
+    index = SnowflakeIndex(range(1, 11))
+    assert list(index.range(after=3, before=7)) == [4, 5, 6]
+    assert list(index.range(after=8)) == [9, 10]
+    assert index.count(after=3, before=7) == 3
+    assert index.count(after=7, before=3) == 0
+
+
+def test_index_trim():
+    index = SnowflakeIndex(range(1, 11))
+    assert index.trim(before=4) == 3
+    assert list(index) == list(range(4, 11))
+
+
+def test_empty_index():
+    index = SnowflakeIndex()
+    assert index.oldest is None
+    assert list(index.range()) == []
+    assert index.trim(100) == 0
+
+
+def test_channel_index_covers_nothing_until_reset():
+    index = ChannelIndex()
+    index.add(1, snowflake.ago(0))
+    assert index.watching_since is None
+    assert not index.covers(1, snowflake.ago(60))
+
+    index.reset()
+    assert len(index[1]) == 0
+    assert index.covers(1, index.watching_since)
+    assert not index.covers(1, snowflake.ago(60))
+
+
+def test_channel_index_tracks_messages_per_channel():
+    index = ChannelIndex()
+    index.reset()
+    first, second = snowflake.ago(0) + 1, snowflake.ago(0) + 2
+    index.add(1, first)
+    index.add(1, second)
+    index.add(2, first)
+
+    index.discard(1, first)
+    assert list(index[1]) == [second]
+    assert list(index[2]) == [first]
+    assert len(index[3]) == 0
+
+    index.forget(2)
+    assert len(index[2]) == 0
+
+
+def test_channel_index_raises_floor_when_full():
+    index = ChannelIndex(max_per_channel=8)
+    index.reset()
+    start = snowflake.ago(0)
+    for i in range(1, 10):
+        index.add(1, start + i)
+
+    # the oldest quarter was dropped, so the index can't answer for them anymore
+    assert len(index[1]) == 7
+    assert index[1].oldest == start + 3
+    assert not index.covers(1, start)
+    assert index.covers(1, start + 2)
+
+
+def test_channel_index_expire():
+    index = ChannelIndex(max_age=60)
+    index.reset()
+    index.watching_since = snowflake.ago(3600)
+    old, new = snowflake.ago(120), snowflake.ago(0)
+    index.add(1, old)
+    index.add(1, new)
+    index.add(2, old)
+
+    index.expire()
+    assert list(index[1]) == [new]
+    assert len(index[2]) == 0
+    assert not index.covers(1, old - 1)
+    assert index.covers(1, snowflake.ago(30))
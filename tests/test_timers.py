@@ -0,0 +1,148 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("discord")
+
+from source import timers
+
+
+def run(scheduler: timers.TimerScheduler, until: float):
+    """Run the scheduler for `until` seconds"""
+
+    async def main():
+        scheduler.start()
+        await asyncio.sleep(until)
+        scheduler.shutdown()
+
+    asyncio.run(main())
+
+
+def recorder():
+    fired = []
+
+    async def callback(key):
+        fired.append(key)
+
+    return fired, callback
+
+
+def test_fires_in_due_order():
+    fired, callback = recorder()
+    scheduler = timers.TimerScheduler(callback)
+    now = time.time()
+    scheduler.schedule("c", now + 0.06)
+    scheduler.schedule("a", now + 0.02)
+    scheduler.schedule("b", now + 0.04)
+
+    run(scheduler, 0.15)
+    assert fired == ["a", "b", "c"]
+    assert len(scheduler) == 0
+
+
+def test_reschedule_replaces_timer():
+    fired, callback = recorder()
+    scheduler = timers.TimerScheduler(callback)
+    now = time.time()
+    scheduler.schedule("a", now + 0.02)
+    scheduler.schedule("b", now + 0.04)
+    scheduler.schedule("a", now + 0.06)
+    assert scheduler.get("a") == pytest.approx(now + 0.06)
+
+    run(scheduler, 0.15)
+    assert fired == ["b", "a"]
+
+
+def test_cancel():
+    fired, callback = recorder()
+    scheduler = timers.TimerScheduler(callback)
+    scheduler.schedule("a", time.time() + 0.02)
+
+    assert scheduler.cancel("a")
+    assert not scheduler.cancel("a")
+    assert "a" not in scheduler
+
+    run(scheduler, 0.05)
+    assert fired == []
+
+
+def test_timer_added_while_running_wakes_scheduler():
+    fired, callback = recorder()
+    scheduler = timers.TimerScheduler(callback)
+
+    async def main():
+        scheduler.schedule("late", time.time() + 60)
+        scheduler.start()
+        await asyncio.sleep(0.01)
+        # earlier than the timer the scheduler is sleeping for
+        scheduler.schedule("soon", time.time() + 0.01)
+        await asyncio.sleep(0.05)
+        scheduler.shutdown()
+
+    asyncio.run(main())
+    assert fired == ["soon"]
+    assert "late" in scheduler
+
+
+def test_overdue_timers_caught_up_in_batches():
+    started = []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def callback(key):
+            started.append(key)
+            await release.wait()
+
+        scheduler = timers.TimerScheduler(callback, batch_size=10)
+        for key in range(25):
+            scheduler.schedule(key, time.time() - 60 + key)
+
+        scheduler.start()
+        await asyncio.sleep(0.02)
+        # the next batch waits for the first to finish
+        assert started == list(range(10))
+
+        release.set()
+        await asyncio.sleep(0.02)
+        scheduler.shutdown()
+
+    asyncio.run(main())
+    assert started == list(range(25))
+
+
+def test_datetimes_are_utc():
+    due = datetime.utcnow() + timedelta(minutes=5)
+    assert timers.TimerScheduler.to_timestamp(due) == pytest.approx(time.time() + 300, abs=1)
+    assert timers.TimerScheduler.to_timestamp(123.5) == 123.5
+
+
+def test_callback_errors_dont_stop_scheduler():
+    fired = []
+
+    async def callback(key):
+        if key == "bad":
+            raise RuntimeError("boom")
+        fired.append(key)
+
+    scheduler = timers.TimerScheduler(callback)
+    now = time.time()
+    scheduler.schedule("bad", now + 0.01)
+    scheduler.schedule("good", now + 0.03)
+
+    run(scheduler, 0.1)
+    assert fired == ["good"]
+
+
+def test_stale_entries_are_compacted():
+    async def callback(key):
+        pass
+
+    scheduler = timers.TimerScheduler(callback)
+    for i in range(5000):
+        scheduler.schedule("a", time.time() + 60 + i)
+
+    assert len(scheduler) == 1
+    assert len(scheduler._heap) <= 2 * len(scheduler) + 1024